@@ -1,5 +1,7 @@
 using System;
+using System.Collections.Generic;
 using System.IO;
+using System.Text;
 using System.Net.Sockets;
 using System.Threading;
 using System.Threading.Tasks;
@@ -39,6 +41,17 @@ public class Client : Editor
 
             stream = client.GetStream();
             Debug.Log("Connected to Aider Bridge.");
+
+            // the final frame of a reply only carries usage, the reply is rebuilt from the streamed frames
+            // and large replies (like the repo map) are split into frames the receive limit allows
+            await SetOptions("final=usage chunk_size=65536");
+
+            var status = await GetStatus();
+            if (status is { ready: false })
+            {
+                if (string.IsNullOrEmpty(status.Value.error)) Debug.Log($"Aider is still starting up ({status.Value.stage}), messages will be answered once it is ready.");
+                else Debug.LogError(status.Value.error);
+            }
             return true;
         }
         catch (Exception e)
@@ -176,6 +189,31 @@ public class Client : Editor
         return response;
     }
 
+    // Receives the reply to a single request, joining it back together if the bridge split it into several frames
+    private static async Task<AiderResponse> ReceiveReplyAsync(int timeout = 0, CancellationToken cancellationToken = default)
+    {
+        var response = await ReceiveSingleResponseAsync(timeout, cancellationToken);
+        if (response.Header.IsLast || response.Header.IsError)
+        {
+            return response;
+        }
+
+        var content = new StringBuilder(response.Content);
+        do
+        {
+            response = await ReceiveSingleResponseAsync(timeout, cancellationToken);
+            if (response.Header.IsError)
+            {
+                return response;
+            }
+
+            content.Append(response.Content);
+        }
+        while (!response.Header.IsLast);
+
+        return new AiderResponse(content.ToString(), response.Header);
+    }
+
     public static async Task ReceiveAllResponesAsync(Action<AiderResponse> callback,CancellationToken cancellationToken = default)
     {
         while (!cancellationToken.IsCancellationRequested)
@@ -200,6 +238,103 @@ public class Client : Editor
         IsStreaming = false;
     }
 
+    /// <summary>
+    /// Set bridge options for this connection, for example "flush_ms=30 final=usage"
+    /// </summary>
+    /// <returns>True if the bridge accepted the options.</returns>
+    public static async Task<bool> SetOptions(string options)
+    {
+        if (!await Send(new AiderRequest("/options " + options)))
+        {
+            return false;
+        }
+
+        var resp = await ReceiveReplyAsync(1000);
+        return !resp.Header.IsError;
+    }
+
+    /// <summary>
+    /// Ask the bridge how far along aider's initialisation is. The bridge answers this while it is still starting up,
+    /// chat messages and context commands sent before it is ready are held until it is.
+    /// </summary>
+    /// <returns>The status, or null if the bridge could not be reached.</returns>
+    public static async Task<BridgeStatus?> GetStatus()
+    {
+        if (!await Send(new AiderRequest("/status")))
+        {
+            return null;
+        }
+
+        var resp = await ReceiveReplyAsync(1000);
+        if (resp.Header.IsError)
+        {
+            return null;
+        }
+
+        return JsonUtility.FromJson<BridgeStatus>(resp.Content);
+    }
+
+    /// <summary>
+    /// Run several context operations (add, drop, ls, read-only, reset, session, scene, objects, write) in one round trip.
+    /// </summary>
+    /// <returns>The result of every operation in order, or null if the batch failed as a whole.</returns>
+    public static async Task<List<BatchResult>> Batch(List<BatchOperation> ops)
+    {
+        var json = JsonUtility.ToJson(new BatchRequest { ops = ops });
+        if (!await Send(new AiderRequest("/batch " + json)))
+        {
+            return null;
+        }
+
+        var resp = await ReceiveReplyAsync(5000);
+        if (resp.Header.IsError)
+        {
+            return null;
+        }
+
+        return JsonUtility.FromJson<BatchResponse>(resp.Content).results;
+    }
+
+    /// <summary>
+    /// Switch the bridge to the session of a chat, each chat keeps its own history and files on the bridge.
+    /// </summary>
+    /// <returns>The session switched to, or null if the switch failed.</returns>
+    public static async Task<SessionInfo?> SwitchSession(string chatID)
+    {
+        if (!await Send(new AiderRequest("/session " + chatID)))
+        {
+            return null;
+        }
+
+        var resp = await ReceiveReplyAsync(5000);
+        if (resp.Header.IsError)
+        {
+            return null;
+        }
+
+        return JsonUtility.FromJson<SessionInfo>(resp.Content);
+    }
+
+    /// <summary>
+    /// Ask the bridge how many tokens the current context takes, to know whether a message will fit before sending it.
+    /// </summary>
+    /// <returns>The token breakdown, or null if the bridge could not be reached.</returns>
+    public static async Task<ContextBudget?> GetContextBudget()
+    {
+        if (!await Send(new AiderRequest("/tokens")))
+        {
+            return null;
+        }
+
+        var resp = await ReceiveReplyAsync(1000);
+        if (resp.Header.IsError)
+        {
+            return null;
+        }
+
+        return JsonUtility.FromJson<ContextBudget>(resp.Content);
+    }
+
     /// <returns>Get a list of all files currently in the context</returns>
     public static async Task<string[]> GetContextList()
     {
@@ -208,7 +343,7 @@ public class Client : Editor
             return new string[0];
         }
 
-        var resp =  await ReceiveSingleResponseAsync();
+        var resp =  await ReceiveReplyAsync();
         if (resp.Header.IsError)
         {
             return new string[0];
@@ -229,7 +364,7 @@ public class Client : Editor
             return false;
         }
 
-        var resp = await ReceiveSingleResponseAsync(1000);
+        var resp = await ReceiveReplyAsync(1000);
         return !resp.Header.IsError;
     }
 
@@ -246,7 +381,7 @@ public class Client : Editor
             return false;
         }
 
-        var resp = await ReceiveSingleResponseAsync(1000);
+        var resp = await ReceiveReplyAsync(1000);
         return !resp.Header.IsError;
     }
 
@@ -262,10 +397,25 @@ public class Client : Editor
             return false;
         }
 
-        var resp = await ReceiveSingleResponseAsync(1000);
+        var resp = await ReceiveReplyAsync(1000);
         return !resp.Header.IsError;
     }
 
+    /// <summary>
+    /// Stop the reply that is currently streaming. The bridge answers with the final frame of that reply,
+    /// which is picked up by the running ReceiveAllResponesAsync loop.
+    /// </summary>
+    /// <returns>True if the cancel request was sent.</returns>
+    public static async Task<bool> Cancel()
+    {
+        if (!IsStreaming)
+        {
+            return false;
+        }
+
+        return await Send(new AiderRequest(AiderCommand.Cancel, ""));
+    }
+
     public static async Task<bool> Reset()
     {
         if (!await Send(new AiderRequest(AiderCommand.Reset, "")))
@@ -273,7 +423,7 @@ public class Client : Editor
             return false;
         }
         
-        var resp = await ReceiveSingleResponseAsync(1000);
+        var resp = await ReceiveReplyAsync(1000);
         return !resp.Header.IsError;
     }
 
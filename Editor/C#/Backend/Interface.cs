@@ -24,7 +24,8 @@ public enum AiderCommand
     ReadOnly = 13,
     Reset = 14,
     Undo = 15,
-    Web = 16
+    Web = 16,
+    Cancel = 17
 }
 
 public static class AiderCommandHelper
@@ -49,7 +50,8 @@ public static class AiderCommandHelper
                 { AiderCommand.ReadOnly, "Add files to the chat that are for reference only, or turn added files to read-only" },
                 { AiderCommand.Reset, "Drop all files and clear the chat history" },
                 { AiderCommand.Undo, "Undo the last git commit if it was done by aider" },
-                { AiderCommand.Web, "Scrape a webpage, convert to markdown and send in a message" }
+                { AiderCommand.Web, "Scrape a webpage, convert to markdown and send in a message" },
+                { AiderCommand.Cancel, "Stop the reply that is currently being generated" }
             });
 
     static string[] SplitCamelCase(this string source)
@@ -132,15 +134,150 @@ public struct AiderRequest
     // see interface.py for the deserialization function
     public byte[] Serialize()
     {
-        Header = new (Content.Length);
+        // the length is in bytes, not characters, so non-ascii content keeps the framing intact
+        var contentBytes = System.Text.Encoding.UTF8.GetBytes(Content);
+        Header = new (contentBytes.Length);
 
         var byteList = new List<byte>();
         byteList.AddRange(Header.Serialize());
-        byteList.AddRange(System.Text.Encoding.UTF8.GetBytes(Content));
+        byteList.AddRange(contentBytes);
         return byteList.ToArray();
     }
 }
 
+// one operation of a /batch request, see control.py for the operations the bridge understands
+[Serializable]
+public struct BatchOperation
+{
+    public string op;
+    public string arg;
+    public string content;
+
+    public static BatchOperation Add(string path) => new() { op = "add", arg = path };
+    public static BatchOperation Drop(string path) => new() { op = "drop", arg = path };
+    public static BatchOperation Ls() => new() { op = "ls" };
+    public static BatchOperation ReadOnly(string path) => new() { op = "read-only", arg = path };
+    public static BatchOperation Reset() => new() { op = "reset" };
+    public static BatchOperation Session(string chatID) => new() { op = "session", arg = chatID };
+    public static BatchOperation Write(string fileName, string content) => new() { op = "write", arg = fileName, content = content };
+    public static BatchOperation Scene(string sceneName, string snapshot) => new() { op = "scene", arg = sceneName, content = snapshot };
+    public static BatchOperation ScenePatch(string sceneName, string patch) => new() { op = "scene-patch", arg = sceneName, content = patch };
+    public static BatchOperation Objects(string message) => new() { op = "objects", content = message };
+    public static BatchOperation Object(string scenePath, string details) => new() { op = "object", arg = scenePath, content = details };
+}
+
+[Serializable]
+public struct BatchResult
+{
+    public string op;
+    public string content;
+    public bool error;
+}
+
+// JsonUtility can't (de)serialize a bare list, so both directions are wrapped in an object
+[Serializable]
+public struct BatchRequest
+{
+    public List<BatchOperation> ops;
+}
+
+[Serializable]
+public struct BatchResponse
+{
+    public List<BatchResult> results;
+}
+
+// reply to /session, see control.session in control.py
+[Serializable]
+public struct SessionInfo
+{
+    public string session;
+    public bool created;
+    public string[] files;
+    public int messages;
+}
+
+// reply to /tokens, see control.tokens in control.py
+[Serializable]
+public struct ContextBudget
+{
+    public int total;
+    public int limit;
+    public int remaining;
+    public ContextBreakdown breakdown;
+    public FileTokens[] files;
+    public FileTokens[] read_only;
+    public FileTokens[] scene;
+    public bool repo_map_stale;
+    public float ms;
+}
+
+[Serializable]
+public struct ContextBreakdown
+{
+    public int system;
+    public int repo_map;
+    public int history;
+    public int pending;
+    public int files;
+    public int read_only;
+    public int scene;
+}
+
+[Serializable]
+public struct FileTokens
+{
+    public string path;
+    public int tokens;
+}
+
+// the objects at one scene path, siblings can share a name so there may be several
+[Serializable]
+public struct SceneObjectGroup
+{
+    public string path;
+    public List<SceneInfoGenerator.SceneObjectInfoSimple> objects;
+}
+
+// a scene-patch batch operation, see scene_store.py
+[Serializable]
+public struct ScenePatch
+{
+    public string epoch;
+    public int baseVersion;
+    public List<SceneObjectGroup> set;
+    public List<string> remove;
+}
+
+// reply to a scene or scene-patch batch operation
+[Serializable]
+public struct SceneVersion
+{
+    public string scene;
+    public string epoch;
+    public int version;
+    public int objects;
+    public bool written;
+}
+
+// reply to an objects batch operation, the scene objects to send the details of, see object_details.py
+[Serializable]
+public struct ObjectsWanted
+{
+    public List<string> paths;
+}
+
+// reply to /status, see Server.status in bridge.py
+[Serializable]
+public struct BridgeStatus
+{
+    public bool ready;
+    public string stage;
+    public float seconds;
+    public string error;
+    public int queued;
+}
+
 public struct AiderResponseHeader
 {
     public static readonly int HeaderSize = 4 + 4 + 1 + 1 + 1 + 4 + 4 + 4 + 4; // headerMarker + contentLength + last + isDiff + isError + tokensSent + tokensReceived + messageCost + sessionCost
@@ -190,7 +327,9 @@ public struct AiderResponse
     public AiderResponseHeader Header { get; set; }
     public string Content { get; set; }
 
-    public bool HasFileChanges => Regex.IsMatch(Content, @"<<<<<<< SEARCH[\n\r]([\s\S]*?)=======[\n\r]([\s\S]+?)[\n\r]>>>>>>> REPLACE", RegexOptions.Multiline | RegexOptions.IgnoreCase);
+    public bool HasFileChanges => ContainsFileChanges(Content);
+
+    public static bool ContainsFileChanges(string content) => Regex.IsMatch(content, @"<<<<<<< SEARCH[\n\r]([\s\S]*?)=======[\n\r]([\s\S]+?)[\n\r]>>>>>>> REPLACE", RegexOptions.Multiline | RegexOptions.IgnoreCase);
 
     public AiderResponse(string content, AiderResponseHeader header)
     {
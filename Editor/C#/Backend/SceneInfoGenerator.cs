@@ -224,6 +224,11 @@ public static class SceneInfoGenerator
     }
 
     public static string GetSceneInfoJson()
+    {
+        return JsonUtility.ToJson(GetSceneInfo(), true);
+    }
+
+    public static SceneInfo GetSceneInfo()
     {
         var sceneName = SceneManager.GetActiveScene().name;
         var unityVersion = Application.unityVersion;
@@ -255,7 +260,7 @@ public static class SceneInfoGenerator
         // sort by path
         sceneInfo.objects.Sort((a, b) => a.scenePath.CompareTo(b.scenePath));
 
-        return JsonUtility.ToJson(sceneInfo, true);
+        return sceneInfo;
     }
 
     public static string GetDetailedObjectInfo(GameObject obj)
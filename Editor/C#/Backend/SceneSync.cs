@@ -0,0 +1,94 @@
+using System.Collections.Generic;
+using UnityEngine;
+
+
+/// <summary>
+/// Keeps track of the scene the bridge has (see scene_store.py), so after the first snapshot
+/// only the objects that changed since the last update are sent.
+/// </summary>
+public static class SceneSync
+{
+    static string sceneName;
+    static string epoch;
+    static int version;
+    // scene path -> JSON of the objects at that path, as the bridge has them
+    static Dictionary<string, string> sent = new();
+
+    // what the bridge has once the last operation is confirmed
+    static string pendingScene;
+    static Dictionary<string, string> pending;
+
+    /// <summary>
+    /// The batch operation that brings the bridge up to date with a scene, confirm it with the result of the batch.
+    /// </summary>
+    /// <param name="full">Send the whole scene even if the bridge already has a version of it.</param>
+    public static BatchOperation Operation(SceneInfoGenerator.SceneInfo info, bool full = false)
+    {
+        var groups = new Dictionary<string, List<SceneInfoGenerator.SceneObjectInfoSimple>>();
+        foreach (var obj in info.objects)
+        {
+            if (!groups.TryGetValue(obj.scenePath, out var objects))
+            {
+                objects = new();
+                groups[obj.scenePath] = objects;
+            }
+            objects.Add(obj);
+        }
+
+        pendingScene = info.sceneName;
+        pending = new();
+        foreach (var group in groups)
+        {
+            pending[group.Key] = JsonUtility.ToJson(new SceneObjectGroup { path = group.Key, objects = group.Value });
+        }
+
+        if (full || epoch == null || sceneName != info.sceneName)
+        {
+            return BatchOperation.Scene(info.sceneName, JsonUtility.ToJson(info));
+        }
+
+        var patch = new ScenePatch { epoch = epoch, baseVersion = version, set = new(), remove = new() };
+        foreach (var group in pending)
+        {
+            if (!sent.TryGetValue(group.Key, out var json) || json != group.Value)
+            {
+                patch.set.Add(new SceneObjectGroup { path = group.Key, objects = groups[group.Key] });
+            }
+        }
+        foreach (var path in sent.Keys)
+        {
+            if (!pending.ContainsKey(path)) patch.remove.Add(path);
+        }
+
+        return BatchOperation.ScenePatch(info.sceneName, JsonUtility.ToJson(patch));
+    }
+
+    /// <summary>
+    /// Record the result of the operation from Operation, a failed one means the next update sends the whole scene.
+    /// </summary>
+    /// <returns>Whether the bridge applied the operation.</returns>
+    public static bool Confirm(BatchResult result)
+    {
+        if (result.error)
+        {
+            Invalidate();
+            return false;
+        }
+
+        var reply = JsonUtility.FromJson<SceneVersion>(result.content);
+        sceneName = pendingScene;
+        epoch = reply.epoch;
+        version = reply.version;
+        sent = pending ?? new();
+        pending = null;
+        return true;
+    }
+
+    public static void Invalidate()
+    {
+        sceneName = null;
+        epoch = null;
+        sent = new();
+        pending = null;
+    }
+}
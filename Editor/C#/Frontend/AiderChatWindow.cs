@@ -5,6 +5,7 @@ using UnityEngine.UIElements;
 using System.IO; 
 using Debug = UnityEngine.Debug;
 using System;
+using System.Collections.Generic;
 using UnityEngine.SceneManagement;
 using System.Threading.Tasks;
 
@@ -110,6 +111,10 @@ public class AiderChatWindow : EditorWindow
             {
                 await SendCurrentMessage();
             }
+            else if (evt.keyCode == KeyCode.Escape && Client.IsStreaming)
+            {
+                await Client.Cancel();
+            }
         });
 
         textField.RegisterValueChangedCallback(evt =>
@@ -121,9 +126,11 @@ public class AiderChatWindow : EditorWindow
         textField.SetPlaceholderText("How can I help you?");
         inputWrapper.Add(textField);
 
+        // the send button stops the reply while one is streaming
         sendButton = new Button(async () =>
         {
-            await SendCurrentMessage();
+            if (Client.IsStreaming) await Client.Cancel();
+            else await SendCurrentMessage();
         });
         sendButton.style.scale = new StyleScale(StyleKeyword.Null);
         sendButton.AddToClassList("send-button");
@@ -201,46 +208,118 @@ public class AiderChatWindow : EditorWindow
         ShowChat();
     }
 
-    private async Task UpdateScene()
+    /// <summary>
+    /// Sends the scene info and GameObject menu to the bridge in a single batch request,
+    /// on the bridge session of the current chat. Only the part of the scene that changed is sent, see SceneSync.
+    /// </summary>
+    /// <param name="reset">Clear the chat context before adding the scene.</param>
+    /// <param name="message">The message about to be sent, the details of the scene objects it names are sent with it.</param>
+    /// <returns>The files in the context afterwards, or null if the batch failed.</returns>
+    private async Task<string[]> UpdateScene(bool reset = false, string message = null)
     {
-        string sceneInfo = SceneInfoGenerator.GetSceneInfoJson();
-        bool success = await Client.AddFileFromMemory($"_{SceneManager.GetActiveScene().name}", sceneInfo);
-        
-        if (success) Debug.Log("Scene info updated");
-        else Debug.LogError("Failed to update scene info");
-
+        var sceneInfo = SceneInfoGenerator.GetSceneInfo();
         string gameObjectMenu = string.Join("\n", MenuItemsUtility.GetMenuItems("GameObject"));
-        success = await Client.AddFileFromMemory("_GameObjectMenu", gameObjectMenu);
 
-        if (success) Debug.Log("GameObject menu updated");
-        else Debug.LogError("Failed to update GameObject menu");
+        var ops = new List<BatchOperation>();
+        if (chatList != null) ops.Add(BatchOperation.Session(chatList.chatID));
+        if (reset) ops.Add(BatchOperation.Reset());
+        int sceneIndex = ops.Count;
+        ops.Add(SceneSync.Operation(sceneInfo));
+        ops.Add(BatchOperation.Write("_GameObjectMenu", gameObjectMenu));
+        int objectsIndex = ops.Count;
+        if (message != null) ops.Add(BatchOperation.Objects(message));
+        ops.Add(BatchOperation.Ls());
+
+        var results = await Client.Batch(ops);
+        if (results == null)
+        {
+            SceneSync.Invalidate();
+            Debug.LogError("Failed to update scene info");
+            return null;
+        }
+
+        // the bridge doesn't have the version of the scene the patch was made against (it restarted), send all of it
+        if (!SceneSync.Confirm(results[sceneIndex]) && results[sceneIndex].op == "scene-patch")
+        {
+            var retry = await Client.Batch(new() { SceneSync.Operation(sceneInfo, true), BatchOperation.Ls() });
+            if (retry == null)
+            {
+                SceneSync.Invalidate();
+                Debug.LogError("Failed to update scene info");
+                return null;
+            }
+
+            SceneSync.Confirm(retry[0]);
+            results[sceneIndex] = retry[0];
+            results[^1] = retry[^1];
+        }
+
+        // the bridge asks for the details of the objects the message or the last reply named, see object_details.py
+        if (message != null && !results[objectsIndex].error)
+        {
+            var wanted = JsonUtility.FromJson<ObjectsWanted>(results[objectsIndex].content);
+            if (wanted.paths != null && wanted.paths.Count > 0)
+            {
+                var detailOps = new List<BatchOperation>();
+                foreach (var path in wanted.paths)
+                {
+                    var obj = FindObjectUtil.FindObject(path);
+                    detailOps.Add(BatchOperation.Object(path, obj != null ? SceneInfoGenerator.GetDetailedObjectInfo(obj) : ""));
+                }
+                detailOps.Add(BatchOperation.Ls());
+
+                var detailResults = await Client.Batch(detailOps);
+                if (detailResults != null) results.AddRange(detailResults);
+                else Debug.LogError("Failed to send object details");
+            }
+        }
+
+        foreach (var result in results)
+        {
+            if (result.error) Debug.LogError($"Failed to {result.op}: {result.content}");
+        }
+
+        Debug.Log("Scene info updated");
+        return results.Last().content.Split('\n', StringSplitOptions.RemoveEmptyEntries);
     }
 
     private void UpdateSendEnabled()
     {
-        if (string.IsNullOrWhiteSpace(textField?.value ?? "") || Client.IsStreaming)
+        if (Client.IsStreaming)
         {
-            sendButton?.SetEnabled(false);
+            sendButton?.SetEnabled(true);
+            sendButton?.AddToClassList("stop-button");
+            if (sendButton != null) sendButton.tooltip = "Stop (Esc)";
         }
         else
         {
-            sendButton?.SetEnabled(true);
+            sendButton?.SetEnabled(!string.IsNullOrWhiteSpace(textField?.value ?? ""));
+            sendButton?.RemoveFromClassList("stop-button");
+            if (sendButton != null) sendButton.tooltip = "Send";
         }
     }
 
     public async Task SendCurrentMessage()
     {
-        await UpdateScene();
+        var context = await UpdateScene(message: textField.value);
+        if (context != null) contextList?.Update(context);
         var req = new AiderRequest(textField.value);
         textField.value = "";
         await Client.Send(req);
         chatList.AddMessage(req.Content, true, "<i><color=#888888>No message content</color></i>");
         chatList.AddMessage("", false, "<i><color=#888888>Thinking...</color></i>");
-        _ = Client.ReceiveAllResponesAsync(HandleResponse);
+        var receiving = Client.ReceiveAllResponesAsync(HandleResponse);
+        UpdateSendEnabled();
+        await receiving;
+        UpdateSendEnabled();
     }
 
     public async Task ReplaceChat(AiderChatList chat)
     {
+        // the bridge keeps a session per chat, so switching back restores the chat's context
+        var session = await Client.SwitchSession(chat.chatID);
+        if (session != null) contextList?.Update(session.Value.files);
+
         VisualElement root = rootVisualElement;
         int index = root.IndexOf(chatList);
         if (index != -1)
@@ -292,11 +371,6 @@ public class AiderChatWindow : EditorWindow
     {
         VisualElement root = rootVisualElement;
 
-        // Clears Aider's context
-        await Client.Reset();
-        await UpdateScene();
-        contextList?.Update(await Client.GetContextList());
-
         int index = 0;
         if (chatList != null)
         {
@@ -316,6 +390,10 @@ public class AiderChatWindow : EditorWindow
         chatList = new AiderChatList(timestamp + "-AiderChat", AiderChatHistory.ChatSavePath);
         root.Insert(index, chatList);
 
+        // the new chat gets a fresh session on the bridge, the scene is added to it in the same round trip
+        var context = await UpdateScene();
+        if (context != null) contextList?.Update(context);
+
         ShowChat();
     }
 
@@ -376,7 +454,7 @@ public class AiderChatWindow : EditorWindow
         var context = await Client.GetContextList();
         contextList.Update(context);
 
-        if (response.HasFileChanges)
+        if (AiderResponse.ContainsFileChanges(messageEl.Message))
         {
             EditorPrefs.SetBool("Aider-ExecuteOnLoad", true);
             AssetDatabase.Refresh();
@@ -404,8 +482,9 @@ public class AiderChatWindow : EditorWindow
                 return;
             }
 
+            // a final frame without content only carries usage, the message was already streamed
             if (response.Header.IsDiff) current.Message += response.Content;
-            else current.Message = response.Content;
+            else if (!response.Header.IsLast || !string.IsNullOrEmpty(response.Content)) current.Message = response.Content;
 
             chatList.ScrollToBottom();
 
@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 from aider.coders import Coder
 from aider.models import Model
 from aider.io import InputOutput
@@ -10,13 +11,35 @@ from dotenv import load_dotenv
 from aider.repo import ANY_GIT_ERROR, GitRepo
 import aider.coders as coders
 from unity_coder import UnityCoder
-from aider.watch import FileWatcher
+import unity_files
+import repo_map_cache
+import watcher
+import sessions
+import chat_store
+import scene_store
+import object_details
+import unity_blocks
+import unity_commands
+from summariser import summariser
 from aider.models import MODEL_ALIASES
 
 total_cost = 0.0
 message_cost = 0.0
 tokens_sent = 0
 tokens_received = 0
+# prompt cache usage of the last message, see UnityCoder.calculate_and_show_tokens_and_cost
+cache_read_tokens = 0
+cache_write_tokens = 0
+
+# initialisation progress, init runs on a background thread while the bridge is already serving (see /status)
+init_stage = "waiting"
+init_started = 0.0
+init_finished = 0.0
+
+def set_init_stage(stage):
+    global init_stage
+    init_stage = stage
+    print(f"Init: {stage}")
 
 def check_config_files_for_yes(config_files):
     found = False
@@ -233,7 +256,11 @@ def init(argv=None, force_git_root=None):
     Initialize the coder. Use the send_message_get_output function to send messages to the coder.
     dry_run: If True, the coder will not modify any files only output reply.
     """
-    global coder
+    global coder, init_started, init_finished
+
+    if not init_started:
+        init_started = time.monotonic()
+    set_init_stage("reading config")
 
     if argv is None:
             argv = sys.argv[1:]
@@ -325,7 +352,8 @@ def init(argv=None, force_git_root=None):
     for fn in args.read or []:
         path = Path(fn).expanduser().resolve()
         if path.is_dir():
-            read_only_fnames.extend(str(f) for f in path.rglob("*") if f.is_file())
+            # prunes Library/ and friends instead of walking them, see unity_files.py
+            read_only_fnames.extend(unity_files.walk(path))
         else:
             read_only_fnames.append(str(path))
 
@@ -351,6 +379,7 @@ def init(argv=None, force_git_root=None):
                 io.tool_error(f"{all_files[0]} is a directory, but --no-git selected.")
                 return 1
 
+    set_init_stage("setting up git")
     if args.git and not force_git_root and git is not None:
         right_repo_root = guessed_wrong_repo(io, git_root, fnames, git_dname)
         if right_repo_root:
@@ -366,10 +395,13 @@ def init(argv=None, force_git_root=None):
 
     if args.cache_prompts and args.map_refresh == "auto":
         args.map_refresh = "files"
+    # stable context first so the provider can reuse the cached prefix, see UnityCoder.format_chat_chunks
+    UnityCoder.prompt_order = "cache" if args.cache_prompts else "default"
 
     if (args.model is None):
         args.model = list(MODEL_ALIASES.keys())[0]
 
+    set_init_stage("loading model")
     model = Model(model=args.model)
 
     repo = None
@@ -392,6 +424,7 @@ def init(argv=None, force_git_root=None):
             pass
 
 
+    set_init_stage("creating coder")
     coders.__all__.append(UnityCoder)
     print(args.edit_format)
     coder = Coder.create(
@@ -404,44 +437,130 @@ def init(argv=None, force_git_root=None):
         use_git=True,
         verbose=args.verbose,
         dry_run=args.dry_run, # a dry run will cause it to not modify files
+        cache_prompts=args.cache_prompts,
+        map_refresh=args.map_refresh,
         stream=True)
     
-    ignores = []
-    if git_root:
-        ignores.append(str(Path(git_root) / ".gitignore"))
-    if args.aiderignore:
-        ignores.append(args.aiderignore)
-
+    # aider's own FileWatcher looks for AI comments to interrupt terminal input, which the bridge has no use for,
+    # this one keeps the repo map and file index up to date instead (see watcher.py).
+    # Without it the caches still notice changes, by mtime and by the git index, just not until they are used
     if args.watch_files:
-        file_watcher = FileWatcher(
-            coder,
-            gitignores=ignores,
-            verbose=args.verbose,
-            root=str(Path.cwd()) if args.subtree_only else None,
-        )
-        coder.file_watcher = file_watcher
-    
-    # calling this forces a repo map update at the start
-    print("Initializing coder...")
+        set_init_stage("starting file watcher")
+        watcher.start(coder)
+
+    # calling this forces a repo map update at the start, only scripts that changed since the last run are parsed
+    set_init_stage("building repo map")
+    repo_map_cache.install(coder)
     coder.format_messages()
-    print("Coder initialized.")
 
+    patch_usage_report(coder)
+    summariser.install(coder)
+    # sessions saved before the bridge restarted are reattached when Unity switches to them
+    chat_store.open_store()
+    chat_store.load(sessions.DEFAULT_SESSION, coder)
+    sessions.pool = sessions.SessionPool(coder, create_session_coder)
+
+    init_finished = time.monotonic()
+    set_init_stage("ready")
+
+
+def patch_usage_report(session_coder):
     # monkey patch function to extract the usage report before it is cleared
-    original_usage_report = coder.show_usage_report
+    original_usage_report = session_coder.show_usage_report
     def show_usage_report():
-        global total_cost, message_cost, tokens_sent, tokens_received
-        global coder
-        total_cost = coder.total_cost
-        message_cost = coder.message_cost
-        tokens_sent = coder.message_tokens_sent
-        tokens_received = coder.message_tokens_received
-
+        capture_usage(session_coder)
         original_usage_report()
-        
-    coder.show_usage_report = show_usage_report
+
+    session_coder.show_usage_report = show_usage_report
+
+
+def create_session_coder(base, chat_id):
+    """
+    A coder for a chat session, with its own chat state but the model, repo and repo map of base (see sessions.py).
+    The chat state is restored from chat_store.py if the session was saved before.
+    """
+    session_coder = Coder.create(
+        from_coder=base,
+        edit_format="unity",
+        fnames=[],
+        read_only_fnames=[],
+        done_messages=[],
+        cur_messages=[],
+        total_cost=0.0,
+        summarize_from_coder=False)
+    session_coder.repo_map = base.repo_map
+    patch_usage_report(session_coder)
+    summariser.install(session_coder)
+    chat_store.load(chat_id, session_coder)
+    return session_coder
+
+
+def activate_session(chat_id):
+    """
+    Switch to the coder of a chat, creating it if needed. Returns the coder and whether it was created.
+    """
+    global coder
+    session, created = sessions.pool.activate(chat_id)
+    coder = session.coder
+    return coder, created
 
 
-def send_message_get_output(message):
+def capture_usage(session_coder=None):
+    """
+    Add the usage of the current reply from the coder, before aider clears it.
+    A message whose command blocks are reflected back to the model gets more than one reply.
+    """
+    global total_cost, message_cost, tokens_sent, tokens_received, cache_read_tokens, cache_write_tokens
+    session_coder = session_coder or coder
+    if not session_coder.message_tokens_sent and not session_coder.message_tokens_received:
+        return
+
+    cache_read_tokens = session_coder.message_cache_read_tokens
+    cache_write_tokens = session_coder.message_cache_write_tokens
+
+    total_cost = session_coder.total_cost
+    message_cost += session_coder.message_cost
+    tokens_sent += session_coder.message_tokens_sent
+    tokens_received += session_coder.message_tokens_received
+
+
+def estimate_usage(partial_output, session_coder=None):
+    """
+    Best effort usage figures for a reply that was cancelled before the provider reported any.
+    Returns (tokens_sent, tokens_received, message_cost, total_cost).
+    """
+    session_coder = session_coder or coder
+    model = session_coder.main_model
+    sent = model.token_count(session_coder.done_messages + session_coder.cur_messages)
+    received = model.token_count(partial_output) if partial_output else 0
+    cost = sent * model.info.get("input_cost_per_token", 0) + received * model.info.get("output_cost_per_token", 0)
+    return sent, received, cost, session_coder.total_cost + cost
+
+
+def interrupt(stream, session_coder=None):
+    """
+    Interrupt a send_message_get_output stream the same way ctrl-c does in aider.
+    Aider then records the partial reply and the interruption, so coder.cur_messages stays consistent.
+    """
+    session_coder = session_coder or coder
+    # aider returns normally from an interrupted reply, this keeps the stream from reflecting it
+    session_coder.stream_interrupted = True
+    # aider exits on a second ctrl-c within two seconds, which for the bridge is just the next cancel
+    session_coder.last_keyboard_interrupt = None
+    try:
+        stream.throw(KeyboardInterrupt())
+        for _ in stream:
+            pass
+    except (KeyboardInterrupt, StopIteration):
+        pass
+    except SystemExit:
+        # whatever aider thinks, a cancel ends the generation and not the bridge
+        print("Aider tried to exit on an interrupt, ignored")
+
+    capture_usage(session_coder)
+
+
+def send_message_get_output(message, session_coder=None, reflect_commands=False):
     """
     This function runs a command and returs the output in async chunks. In order to process these chunks run something like this:
 
@@ -452,17 +571,50 @@ def send_message_get_output(message):
         handle_output_chunk(output) 
     ```
 
+    session_coder defaults to the coder of the active chat session.
+    reflect_commands sends ```unity blocks that fail their checks back to the model (see unity_commands.py),
+    only for clients that run the checked commands and skip the rejected ones.
     """
 
-    global coder
-    coder.init_before_message()
-    message = coder.preproc_user_input(message)
-    coder.reflected_message = None
+    global message_cost, tokens_sent, tokens_received, cache_read_tokens, cache_write_tokens
+    message_cost = 0.0
+    tokens_sent = 0
+    tokens_received = 0
+    cache_read_tokens = 0
+    cache_write_tokens = 0
+
+    session_coder = session_coder or coder
+    session_coder.message_cache_read_tokens = 0
+    session_coder.message_cache_write_tokens = 0
+    session_coder.stream_interrupted = False
+    # swap in the history summarised since the last message, if it is ready
+    summariser.apply(session_coder)
+    session_coder.init_before_message()
+    message = session_coder.preproc_user_input(message)
+    session_coder.reflected_message = None
     if (message is None or len(message) == 0):
         print("Empty message, nothing to do.")
         return "..."
     
-    yield from coder.send_message(message)
+    # large scenes are pruned to what the message is about, see scene_context.py
+    scene_store.store.refresh(message, session_coder.main_model.token_count)
+    object_details.materialise(session_coder)
+    while message:
+        yield from session_coder.send_message(message)
+        reply = session_coder.partial_response_content or ""
+        scene_store.store.remember(reply)
+        if session_coder.stream_interrupted or not reflect_commands:
+            break
+        # command blocks that wouldn't run go straight back to the model, like aider reflects failed edits
+        message = unity_commands.reflection(unity_blocks.parse_reply(reply))
+        if message:
+            if session_coder.num_reflections >= session_coder.max_reflections:
+                print(f"Only {session_coder.max_reflections} reflections allowed, stopping.")
+                break
+            session_coder.num_reflections += 1
+            yield "\n\n"
+    summariser.schedule(session_coder)
+    chat_store.save(session_coder)
 
 if __name__ == "__main__":
     init()
@@ -1,179 +1,654 @@
-import os
+import asyncio
+import hashlib
+import json
 import random
-import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import aider_main as aider
-from network_interface import AiderCommand, AiderRequest, AiderRequestHeader, AiderResponse
+import chat_store
+import control
+import metrics
+import object_details
+import unity_commands
+from codec import PROTOCOL_VERSION, SUPPORTED_VERSIONS
+from coalescer import Coalescer, DEFAULT_FLUSH_BYTES, DEFAULT_FLUSH_MS
+from network_interface import AiderCommand, AiderRequest, AiderRequestHeader, AiderResponse, AiderResponseKind
+from transfer import IncomingRequest, fragment_response
+from unity_blocks import Block, BlockExtractor
+from unity_coder import hit_rate
 
+# per connection options, changed with /options key=value ...
+DEFAULT_OPTIONS = {
+    "flush_bytes": DEFAULT_FLUSH_BYTES,
+    "flush_ms": DEFAULT_FLUSH_MS,
+    # what the final frame of a reply carries besides the usage figures:
+    # full: the whole reply again, usage: nothing, digest: "sha256:<hex>" of the whole reply
+    "final": "full",
+    # replies longer than this many characters are sent as several frames, 0 sends them whole
+    "chunk_size": 0,
+}
+OPTION_CHOICES = {
+    "final": ("full", "usage", "digest"),
+}
 
-# taken from https://stackoverflow.com/questions/17667903/python-socket-receive-large-amount-of-data
-def recvall(sock, n):
-    # Helper function to recv n bytes or return None if EOF is hit
-    data = bytearray()
-    
-    if (n <= 0):
-        return data
 
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data.extend(packet)
-    return data
+class Connection:
+    """
+    A single client (a Unity editor instance, a CLI tool, ...) connected to the bridge.
+    All socket io happens on the event loop, use send_threadsafe to send from worker threads.
+    """
 
-class Server:
-    def __init__(self):
-        self.host = 'localhost'
-        self.port = 65234
-        self.server_socket = None
-        self.conn = None
-        self.addr = None
-
-    def start(self):
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((self.host, self.port))
-        actual_port = self.server_socket.getsockname()[1]
-        self.server_socket.listen()
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.addr = writer.get_extra_info("peername")
+        self.generation: Generation = None
+        self.options = dict(DEFAULT_OPTIONS)
+        # protocol version agreed on with /hello, requests are answered in their own version regardless
+        self.version = 1
+        # version 2 requests are handled concurrently, these are the ones still running
+        self.tasks: set[asyncio.Task] = set()
 
-        print(f"Server listening on {self.host}:{actual_port}")
-        self.conn, self.addr = self.server_socket.accept()
-        print(f"Connected on {self.addr}")
+    @property
+    def closed(self) -> bool:
+        return self.writer.is_closing()
 
     def send(self, message: AiderResponse):
-        msg = message.serialize()
-        self.conn.sendall(msg)
+        if self.closed:
+            return
+
+        # header and body go out in one scatter/gather write without being joined first
+        self.writer.writelines(message.serialize_parts())
+
+    def send_threadsafe(self, message: AiderResponse):
+        self.loop.call_soon_threadsafe(self.send, message)
+
+    async def reply(self, message: AiderResponse, request: AiderRequest = None):
+        """
+        Send a reply to a request, split into chunk_size frames if it is too large.
+        Drains after every frame so a large reply is never buffered in full.
+        """
+        for frame in fragment_response(message, self.options["chunk_size"]):
+            self.send(frame.reply_to(request))
+            await self.drain()
+
+    async def reply_string(self, string: str, request: AiderRequest = None):
+        await self.reply(AiderResponse(string, True), request)
+
+    async def reply_error(self, string: str, request: AiderRequest = None):
+        await self.reply(AiderResponse(string, True, False, True), request)
+
+    def hello(self, text: str) -> AiderResponse:
+        """
+        Version handshake, the client sends the highest version it speaks and gets the one both sides speak.
+        """
+        try:
+            requested = int(text.strip() or 1)
+        except ValueError:
+            return AiderResponse(f"Invalid protocol version {text.strip()}.", True, False, True)
+
+        self.version = max(1, min(requested, PROTOCOL_VERSION))
+        return AiderResponse(json.dumps({"version": self.version, "supported": list(SUPPORTED_VERSIONS)}), True)
+
+    def update_options(self, text: str) -> AiderResponse:
+        """
+        Set options from "key=value key=value ...", replies with all the current options.
+        """
+        for pair in text.split():
+            key, _, value = pair.partition("=")
+            if key not in DEFAULT_OPTIONS:
+                return AiderResponse(f"Unknown option {key}.", True, False, True)
+
+            try:
+                value = type(DEFAULT_OPTIONS[key])(value)
+            except ValueError:
+                return AiderResponse(f"Invalid value {value} for option {key}.", True, False, True)
+
+            if key in OPTION_CHOICES and value not in OPTION_CHOICES[key]:
+                return AiderResponse(f"Invalid value {value} for option {key}, expected one of {', '.join(OPTION_CHOICES[key])}.", True, False, True)
 
-    def send_string(self, string: str):
-        self.send(AiderResponse(string, True))
+            self.options[key] = value
 
-    def send_error(self, string: str):
-        self.send(AiderResponse(string, True, True))
+        return AiderResponse("\n".join(f"{key}={value}" for key, value in self.options.items()), True)
 
-    def simulate_reply(self, string: str):
+    async def simulate_reply(self, string: str):
         words = string.split(" ")
         for i, word in enumerate(words):
             if i < len(words) - 1:
                 print(word + " ", end="", flush=True)
-                self.send(AiderResponse(word + " "))
-                time.sleep(random.uniform(0.01, 0.2))
+                self.send(AiderResponse(word + " ", False, True))
+                await asyncio.sleep(random.uniform(0.01, 0.2))
             else:
                 self.send(AiderResponse(word, True))
 
-    def receive(self):
-        print("Waiting for data...")
-        header_data = self.conn.recv(AiderRequestHeader.HEADER_SIZE)
-        if not header_data or len(header_data) < AiderRequestHeader.HEADER_SIZE:
-            print("No header data received")
-            return None
-    
+    async def receive_header(self) -> AiderRequestHeader:
+        header_data = await self.reader.readexactly(AiderRequestHeader.HEADER_SIZE)
         print("Header data received:", header_data)
-        
+
         header = AiderRequestHeader.deserialize(header_data)
-        if header is None or header.content_length <= 0:
+        if header is None:
+            return None
+
+        if header.extension_size:
+            header.deserialize_extension(await self.reader.readexactly(header.extension_size))
+        return header
+
+    async def receive(self):
+        print(f"Waiting for data from {self.addr}...")
+        try:
+            header = await self.receive_header()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print("No header data received")
+            return None
+
+        if header is None or header.content_length < 0 or (header.content_length == 0 and not header.is_fragment):
             print("Invalid content length")
             return None
-        
+
         print("header:", header.header_marker, header.content_length)
 
-        data = recvall(self.conn, header.content_length)
-        if not data:
+        if header.is_fragment:
+            return await self.receive_fragments(header)
+
+        try:
+            data = await self.reader.readexactly(header.content_length)
+        except (asyncio.IncompleteReadError, ConnectionError):
             print("No data received")
             return None
-        
+
         print("Data received:", data)
         return AiderRequest.deserialize(data, header)
 
-    def close(self):
-        self.conn.close()
-        self.server_socket.close()
+    async def receive_fragments(self, header: AiderRequestHeader):
+        """
+        Receive a request sent as sequenced fragments, each one is decoded and passed on as it arrives.
+        """
+        first = header
+        incoming = IncomingRequest()
+        try:
+            while True:
+                incoming.feed(header.sequence, await self.reader.readexactly(header.content_length), header.is_last_fragment)
+                if header.is_last_fragment:
+                    break
 
-    def __enter__(self):
-        return self
+                header = await self.receive_header()
+                if header is None or not header.is_fragment or header.content_length < 0 or header.request_id != first.request_id:
+                    raise ValueError("Expected another fragment")
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            print(f"Failed to receive fragmented request: {e}")
+            incoming.abort()
+            return None
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
+        print(f"Received {incoming.size} bytes in {incoming.expected_sequence} fragments")
+        return incoming.finish(first)
 
-def main():
-    aider.init()
-    with Server() as server:
-        while True: # continue to listen for new connections
-            server.start()
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class Generation:
+    """
+    A chat message being answered on a worker thread.
+    Chunks are coalesced into frames on the event loop (see coalescer.py).
+    Frames always go through send so nothing is written after the final frame, even if the
+    worker keeps running for a moment after being cancelled.
+    """
+
+    def __init__(self, conn: Connection, request: AiderRequest):
+        self.conn = conn
+        self.request = request
+        self.content = request.content
+        self.output = ""
+        self.cancelled = threading.Event()
+        self.done = asyncio.Event()
+        self.finished = False
+        self.task: asyncio.Task = None
+        self.coder = None
+        self.coalescer = Coalescer(self.send_chunk, conn.options["flush_bytes"], conn.options["flush_ms"])
+
+    def send(self, message: AiderResponse):
+        if self.finished:
+            return
+
+        if message.last:
+            self.coalescer.close()
+
+        self.finished = message.last
+        self.conn.send(message.reply_to(self.request))
+
+    def send_chunk(self, text: str):
+        self.send(AiderResponse(text, False, True))
+
+    def abandon(self):
+        """
+        Stop a generation whose connection closed, the worker interrupts the reply the same way as for /cancel
+        and nothing more is sent. A generation still queued is skipped when its turn comes.
+        """
+        self.finished = True
+        self.cancelled.set()
+
+    def push_threadsafe(self, text: str):
+        self.conn.loop.call_soon_threadsafe(self.coalescer.push, text)
+
+    def send_threadsafe(self, message: AiderResponse):
+        self.conn.loop.call_soon_threadsafe(self.send, message)
+
+    def send_block(self, block: Block):
+        """
+        Send a command block as its own frame, after all the text that came before it.
+        """
+        if self.finished:
+            return
+
+        self.coalescer.flush()
+        content = json.dumps(block.command) if block.valid else block.source
+        frame = AiderResponse(content, False)
+        frame.kind = AiderResponseKind.COMMAND
+        frame.meta = block.to_meta()
+        self.send(frame)
+
+    def send_block_threadsafe(self, block: Block):
+        self.conn.loop.call_soon_threadsafe(self.send_block, block)
+
+    def send_batch(self, commands: list[dict], rejected: int):
+        """
+        The commands of the reply to run, in order and as one transaction, after its last block.
+        Clients run these, not the command frames, which include the blocks that were rejected.
+        """
+        if self.finished:
+            return
+
+        self.coalescer.flush()
+        frame = AiderResponse(json.dumps(commands), False)
+        frame.kind = AiderResponseKind.BATCH
+        frame.meta = {"count": len(commands), "rejected": rejected}
+        self.send(frame)
+
+    def send_batch_threadsafe(self, commands: list[dict], rejected: int):
+        self.conn.loop.call_soon_threadsafe(self.send_batch, commands, rejected)
+
+    def send_objects(self, paths: list[str]):
+        """
+        Ask for the details of scene objects the reply named, after all the text that came before them.
+        """
+        if self.finished:
+            return
+
+        self.coalescer.flush()
+        frame = AiderResponse("\n".join(paths), False)
+        frame.kind = AiderResponseKind.OBJECTS
+        frame.meta = {"paths": paths}
+        self.send(frame)
+
+    def send_objects_threadsafe(self, paths: list[str]):
+        self.conn.loop.call_soon_threadsafe(self.send_objects, paths)
 
+    def final_response(self, tokens_sent: int, tokens_received: int, message_cost: float, session_cost: float) -> AiderResponse:
+        """
+        The last frame of the reply, its content depends on the final option of the connection.
+        Clients that don't get the full reply here rebuild it from the streamed frames.
+        """
+        match self.conn.options["final"]:
+            case "usage":
+                content = ""
+            case "digest":
+                content = "sha256:" + hashlib.sha256(self.output.encode()).hexdigest()
+            case _:
+                content = self.output
+
+        return AiderResponse(content, True, False, False, tokens_sent, tokens_received, message_cost, session_cost)
+
+
+class Server:
+    """
+    Asyncio bridge server. Every connection gets its own task so several clients can be served at once.
+    LLM generations run on a worker thread so the event loop stays free to answer other connections,
+    and control commands (see control.py) are answered out of band, even on the connection that is streaming.
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = 65234):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections: set[Connection] = set()
+        # sessions share the model and repo, so only one generation may run at a time
+        self.generation_lock = asyncio.Lock()
+        # control commands get their own thread so they never wait behind a generation or block the event loop
+        self.control_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="control")
+        self.active_generation: Generation = None
+        # generations that haven't sent their final frame yet, running or queued
+        self.generations: set[Generation] = set()
+        # aider is initialised in the background (see initialize), set once the coder can be used
+        self.ready = asyncio.Event()
+        self.init_error: str = None
+        # the event loop only keeps a weak reference to a task, this keeps initialize from being collected mid-run
+        self.init_task: asyncio.Task = None
+        metrics.register("startup", self.status)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        actual_port = self.server.sockets[0].getsockname()[1]
+        print(f"Server listening on {self.host}:{actual_port}")
+
+    async def initialize(self, init=aider.init):
+        """
+        Initialise aider on a worker thread while the server is already accepting connections.
+        Requests that need the coder wait for this (see wait_ready), everything else is served right away.
+        """
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, init)
+            if result is not None or aider.coder is None:
+                self.init_error = f"Aider failed to initialise during {aider.init_stage}."
+        except Exception as e:
+            self.init_error = f"Aider failed to initialise during {aider.init_stage}: {e}"
+
+        if self.init_error:
+            print(self.init_error)
+        self.ready.set()
+
+    async def wait_ready(self, conn: Connection, request: AiderRequest) -> bool:
+        """
+        Wait until aider is initialised, replies with an error and returns False if it failed to.
+        """
+        if not self.ready.is_set():
+            print(f"Waiting for aider to initialise before handling {request.get_command_string()}")
+            await self.ready.wait()
+
+        if self.init_error:
+            await conn.reply_error(self.init_error, request)
+            return False
+        return True
+
+    def status(self) -> dict:
+        started = aider.init_started or time.monotonic()
+        finished = aider.init_finished or time.monotonic()
+        return {
+            "ready": self.ready.is_set() and not self.init_error,
+            "stage": aider.init_stage,
+            "seconds": round(finished - started, 3),
+            "error": self.init_error,
+            "queued": len(self.generations),
+        }
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = Connection(reader, writer)
+        self.connections.add(conn)
+        print(f"Connected on {conn.addr} ({len(self.connections)} open connections)")
+
+        try:
             while True: # continue to listen for new messages
-                request = server.receive()
+                request = await conn.receive()
                 print(f"Received request: {request}")
 
                 if request is None:
                     break
 
-                command = request.get_command()
-                command_name = request.get_command_string()
-                print(f"Received command: {command_name}")
-
-                coder = aider.coder
-
-                match command:
-                    case AiderCommand.UNKNOWN:
-                        server.send_error(f"The command {command_name} is not recognized.")
-                        continue
-                    case AiderCommand.LS:
-                        server.send_string("\n".join(coder.abs_fnames))
-                        continue
-                    case AiderCommand.ADD:
-                        name = coder.get_rel_fname(request.strip_command())
-                        if os.path.exists(name):
-                            coder.add_rel_fname(name) 
-                            server.send_string(f"Added {name}")
-                        else:
-
-                            # check if there is only one file in all files that ends with filename
-                            # because the user may have just put the name of the file not the path
-                            filename = name.replace("\\", "/").split("/")[-1]
-                            matches = [fname for fname in coder.get_all_relative_files() if fname.endswith(f"{filename}")]
-                            if len(matches) == 1:
-                                coder.add_rel_fname(matches[0])
-                                server.send_string(f"Added {matches[0]} implicitly.")
-                            else:
-                                server.send_error(f"Cannot add {name} because it does not exist.")
-
-                        continue
-                    case AiderCommand.DROP:
-                        name = coder.get_rel_fname(request.strip_command())
-                        if name in coder.get_inchat_relative_files():
-                            coder.drop_rel_fname(name) 
-                            server.send_string(f"Dropped {name}")
-                        else:
-                            
-                            # do the same for drop as we did for add
-                            filename = name.replace("\\", "/").split("/")[-1]
-                            matches = [fname for fname in coder.get_inchat_relative_files() if fname.endswith(f"{filename}")]
-                            if len(matches) == 1:
-                                coder.drop_rel_fname(matches[0])
-                                server.send_string(f"Dropped {matches[0]} implicitly.")
-                            else:
-                                server.send_error(f"Cannot drop {name} because it is not in chat.")
-
-                        continue
-                    case AiderCommand.MAP:
-                        print("Sending repo map")
-                        server.send_string(coder.get_repo_map())
-                    case AiderCommand.RESET:
-                        coder.abs_fnames = set()
-                        coder.abs_read_only_fnames = set()
-                        coder.done_messages = []
-                        coder.cur_messages = []
-                        server.send_string("Reset chat successfully.")
-                        continue 
-
-                full_output = ""
-                for output in aider.send_message_get_output(request.content):
-                    full_output += output
-                    server.send(AiderResponse(output, False, True))
-
-                print(f"Tokens sent: {aider.tokens_sent}, Tokens received: {aider.tokens_received}, Message cost: {aider.message_cost}, Session cost: {aider.total_cost}")
-                
-                server.send(AiderResponse(full_output, True, False, False, aider.tokens_sent, aider.tokens_received, aider.message_cost, aider.total_cost))
+                # version 2 responses carry the request id, so those requests don't have to wait for each other
+                if request.version >= 2:
+                    task = asyncio.create_task(self.handle_request(conn, request))
+                    conn.tasks.add(task)
+                    task.add_done_callback(conn.tasks.discard)
+                    continue
+
+                await self.handle_request(conn, request)
+                await conn.drain()
+        finally:
+            self.connections.discard(conn)
+            for task in list(conn.tasks):
+                task.cancel()
+            # nobody is left to read the replies of this connection, don't keep paying for them
+            for generation in list(self.generations):
+                if generation.conn is conn and not generation.finished:
+                    generation.abandon()
+            await conn.close()
+            print(f"Disconnected from {conn.addr} ({len(self.connections)} open connections)")
+
+    async def handle_request(self, conn: Connection, request: AiderRequest):
+        command = request.get_command()
+        command_name = request.get_command_string()
+        print(f"Received command: {command_name}")
+
+        # commands that don't need the coder, these are answered even while aider is still initialising
+        match command:
+            case AiderCommand.UNKNOWN:
+                await conn.reply_error(f"The command {command_name} is not recognized.", request)
+                return
+            case AiderCommand.CANCEL:
+                await self.cancel_generation(conn, request)
+                return
+            case AiderCommand.OPTIONS:
+                await conn.reply(conn.update_options(request.strip_command()), request)
+                return
+            case AiderCommand.STATS:
+                await conn.reply_string(json.dumps(metrics.snapshot()), request)
+                return
+            case AiderCommand.HELLO:
+                await conn.reply(conn.hello(request.strip_command()), request)
+                return
+            case AiderCommand.STATUS:
+                await conn.reply_string(json.dumps(self.status()), request)
+                return
+
+        # chat messages are queued behind the generation lock anyway, they wait for initialisation there (see run_generation)
+        if command in CONTROL_COMMANDS:
+            if not await self.wait_ready(conn, request):
+                return
+            await self.handle_control(conn, request, command)
+            return
+
+        # generations run in the background so this connection can keep sending control commands
+        generation = Generation(conn, request)
+        generation.task = asyncio.create_task(self.run_generation(generation))
+        conn.generation = generation
+        self.generations.add(generation)
+
+    async def handle_control(self, conn: Connection, request: AiderRequest, command: AiderCommand):
+        match command:
+            case AiderCommand.LS:
+                await conn.reply(await self.run_control(control.ls), request)
+            case AiderCommand.ADD:
+                await conn.reply(await self.run_control(control.add, request.strip_command()), request)
+            case AiderCommand.DROP:
+                await conn.reply(await self.run_control(control.drop, request.strip_command()), request)
+            case AiderCommand.WRITE:
+                await conn.reply(await self.run_control(control.write, request), request)
+            case AiderCommand.BATCH:
+                await conn.reply(await self.run_control(control.batch, request.strip_command()), request)
+            case AiderCommand.MAP:
+                await conn.reply(await self.run_control(control.repo_map), request)
+            case AiderCommand.RESET:
+                await conn.reply(await self.run_control(control.reset), request)
+            case AiderCommand.SESSION:
+                await conn.reply(await self.run_control(control.session, request.strip_command()), request)
+            case AiderCommand.TOKENS:
+                await conn.reply(await self.run_control(control.tokens), request)
+            case AiderCommand.SCENE | AiderCommand.SCENE_PATCH:
+                await conn.reply(await self.run_control(control.scene_request, request), request)
+
+    async def run_control(self, func, *args) -> AiderResponse:
+        """
+        Run a control command on the control thread with the coder of the active chat session.
+        The coder is looked up there, so a command queued behind a /session switch sees the new session.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.control_executor, run_control_command, func, *args)
+
+    async def run_generation(self, generation: Generation):
+        if not self.ready.is_set():
+            print("Queued message until aider is initialised")
+            await self.ready.wait()
+
+        async with self.generation_lock:
+            try:
+                # cancelled while it was waiting for its turn
+                if generation.finished:
+                    return
+
+                if self.init_error:
+                    generation.send(AiderResponse(self.init_error, True, False, True))
+                    return
+
+                self.active_generation = generation
+                # the chat session is fixed when the generation starts, switching sessions while it streams doesn't affect it
+                generation.coder = aider.coder
+                await asyncio.get_running_loop().run_in_executor(None, stream_generation, generation)
+            finally:
+                self.active_generation = None
+                self.generations.discard(generation)
+                generation.done.set()
+
+    def find_generation(self, conn: Connection, request: AiderRequest) -> Generation:
+        """
+        The generation a cancel request is about: the one with the request id given as argument,
+        the last one started by this connection, or the one of this connection currently running.
+        A connection can only cancel its own generations.
+        """
+        argument = request.strip_command().strip()
+        if argument:
+            for generation in self.generations:
+                if generation.conn is conn and str(generation.request.request_id) == argument and not generation.finished:
+                    return generation
+            return None
+
+        if conn.generation and not conn.generation.finished:
+            return conn.generation
+        if self.active_generation and self.active_generation.conn is conn:
+            return self.active_generation
+        return None
+
+    async def cancel_generation(self, conn: Connection, request: AiderRequest):
+        """
+        Cancel a generation (see find_generation).
+        The worker only notices the cancel when the next chunk arrives, so if it hasn't wound down
+        within CANCEL_GRACE the final frame is sent straight away with estimated usage.
+        """
+        generation = self.find_generation(conn, request)
+        if generation is None or generation.finished:
+            # a version 1 client that cancels just as the final frame arrives doesn't read a reply to the cancel,
+            # answering would shift every reply after it by one
+            if request.version >= 2:
+                await conn.reply_error("There is no generation to cancel.", request)
+            return
+
+        print("Cancelling generation")
+        generation.cancelled.set()
+        try:
+            await asyncio.wait_for(generation.done.wait(), CANCEL_GRACE)
+        except asyncio.TimeoutError:
+            # a generation that is still queued hasn't used anything yet
+            usage = aider.estimate_usage(generation.output, generation.coder) if generation is self.active_generation else (0, 0, 0.0, aider.total_cost)
+            generation.send(generation.final_response(*usage))
+
+        # for a version 1 client the final frame of the generation is the reply to the cancel,
+        # version 2 clients can tell the two apart so they get both
+        if request.version >= 2:
+            await conn.reply_string("Cancelled generation.", request)
+
+
+CANCEL_GRACE = 0.1 # seconds
+
+# commands answered by control.py, these need the coder
+CONTROL_COMMANDS = (
+    AiderCommand.LS, AiderCommand.ADD, AiderCommand.DROP, AiderCommand.WRITE,
+    AiderCommand.BATCH, AiderCommand.MAP, AiderCommand.RESET, AiderCommand.SESSION,
+    AiderCommand.TOKENS, AiderCommand.SCENE, AiderCommand.SCENE_PATCH,
+)
+
+
+def run_control_command(func, *args) -> AiderResponse:
+    """
+    Runs on the control thread.
+    """
+    response = func(aider.coder, *args)
+    # persist whatever the command changed in the session, see chat_store.py
+    chat_store.save(aider.coder)
+    return response
+
+
+def stream_generation(generation: Generation):
+    """
+    Runs on a worker thread. Streams the reply to the connection chunk by chunk,
+    every ```unity command block as soon as it closes, then the valid commands as one batch.
+    Blocks the model had to correct (see unity_commands.py) are rejected, their corrections come later in the reply.
+    Scene objects the reply names are queued for their details to be sent with the next message (see object_details.py).
+    """
+    # command blocks and objects go out as typed frames, which only version 2 clients can tell apart from text,
+    # and only they run the commands from the batch frame, so only their rejected blocks can be reflected
+    typed = generation.request.version >= 2
+    stream = aider.send_message_get_output(generation.content, generation.coder, reflect_commands=typed)
+    extractor = BlockExtractor() if typed else None
+    blocks = []
+    scanner = object_details.ReplyScanner(generation.coder)
+    try:
+        for output in stream:
+            if generation.cancelled.is_set():
+                print("Generation cancelled")
+                aider.interrupt(stream, generation.coder)
+                break
+
+            generation.output += output
+            generation.push_threadsafe(output)
+            if extractor:
+                for block in extractor.feed(output):
+                    blocks.append(block)
+                    generation.send_block_threadsafe(block)
+            paths = scanner.feed(output)
+            if paths and typed:
+                generation.send_objects_threadsafe(paths)
+    finally:
+        stream.close()
+
+    if not generation.cancelled.is_set():
+        if extractor:
+            for block in extractor.finish():
+                blocks.append(block)
+                generation.send_block_threadsafe(block)
+            commands = unity_commands.batch(blocks)
+            if commands:
+                generation.send_batch_threadsafe(commands, len(blocks) - len(commands))
+        paths = scanner.finish()
+        if paths and typed:
+            generation.send_objects_threadsafe(paths)
+
+    print(f"Tokens sent: {aider.tokens_sent}, Tokens received: {aider.tokens_received}, Message cost: {aider.message_cost}, Session cost: {aider.total_cost}")
+
+    response = generation.final_response(aider.tokens_sent, aider.tokens_received, aider.message_cost, aider.total_cost)
+    # prompt cache usage, only version 2 frames carry meta
+    response.meta = {"cache": {
+        "read_tokens": aider.cache_read_tokens,
+        "write_tokens": aider.cache_write_tokens,
+        "hit_rate": hit_rate(aider.cache_read_tokens, aider.tokens_sent),
+    }}
+    generation.send_threadsafe(response)
+
+
+async def serve():
+    server = Server()
+    # listen first, so the editor can connect while aider is still starting up
+    await server.start()
+    server.init_task = asyncio.create_task(server.initialize())
+    await server.serve_forever()
+
+def main():
+    asyncio.run(serve())
 
 if __name__ == "__main__":
     main()
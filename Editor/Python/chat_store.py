@@ -0,0 +1,312 @@
+"""
+Append-only on-disk store of each chat session's history and files, so a session survives a bridge restart
+(a crash or a Unity domain reload) and is reattached without sending the conversation through the LLM again.
+
+The history of a session is done_messages followed by cur_messages. aider only moves cur_messages into
+done_messages after a reply that edited files, so most turns of a Unity chat stay in cur_messages.
+Every session has a log of length-prefixed records in Data/Sessions~ (Unity doesn't import folders ending in ~):
+  APPEND   messages added to the end of the history since the last record
+  REPLACE  the whole history, written when it was summarised, trimmed or reset
+  FILES    the files in chat and the read-only files, relative to the repo root
+  CURRENT  how many messages at the end of the history are cur_messages
+A REPLACE record is always followed by a FILES and a CURRENT record, together they are a checkpoint. index.json maps every
+session to its log and the offset of its last checkpoint, so loading a session reads from there and skips
+everything before it. Logs are compacted down to their last checkpoint once the skipped part is most of the file.
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+import metrics
+from paths import DATA_DIR
+
+STORE_DIR = DATA_DIR / "Sessions~"
+INDEX_PATH = STORE_DIR / "index.json"
+
+# length of the payload, record type
+RECORD_HEADER = struct.Struct("<IB")
+APPEND = 1
+REPLACE = 2
+FILES = 3
+CURRENT = 4
+# set on the record type when the payload is zlib compressed
+COMPRESSED = 0x80
+# payloads smaller than this aren't worth compressing
+COMPRESS_MIN = 512
+
+# compact a log once the records before its last checkpoint make up more than this share of it
+COMPACT_RATIO = 0.75
+COMPACT_MIN_BYTES = 64 * 1024
+
+
+class ChatStoreStats:
+    def __init__(self):
+        self.records = 0
+        self.bytes_written = 0
+        self.checkpoints = 0
+        self.compactions = 0
+        self.loads = 0
+        self.load_ms = 0.0
+        self.corrupt_tails = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "sessions": len(store.index) if store else 0,
+            "records": self.records,
+            "bytes_written": self.bytes_written,
+            "checkpoints": self.checkpoints,
+            "compactions": self.compactions,
+            "loads": self.loads,
+            "avg_load_ms": round(self.load_ms / self.loads, 3) if self.loads else 0.0,
+            "corrupt_tails": self.corrupt_tails,
+        }
+
+
+stats = ChatStoreStats()
+metrics.register("chat_store", stats.to_dict)
+
+
+def encode_record(kind: int, value) -> bytes:
+    payload = json.dumps(value, separators=(",", ":")).encode()
+    if len(payload) >= COMPRESS_MIN:
+        payload = zlib.compress(payload, 1)
+        kind |= COMPRESSED
+    return RECORD_HEADER.pack(len(payload), kind) + payload
+
+
+def read_records(data: bytes, offset: int = 0):
+    """
+    Yields (offset after the record, type, value) for every complete record from offset on.
+    A torn record at the end (the bridge died while writing it) ends the iteration.
+    """
+    while offset + RECORD_HEADER.size <= len(data):
+        length, kind = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > len(data):
+            return
+
+        payload = data[start:start + length]
+        try:
+            if kind & COMPRESSED:
+                payload = zlib.decompress(payload)
+            value = json.loads(payload)
+        except (zlib.error, ValueError):
+            return
+
+        offset = start + length
+        yield offset, kind & ~COMPRESSED, value
+
+
+def safe_name(session_id: str) -> str:
+    # ids that only differ in the characters replaced ("a b" and "a_b") still get their own log
+    digest = hashlib.blake2b(session_id.encode(), digest_size=4).hexdigest()
+    return (re.sub(r"[^A-Za-z0-9_.-]", "_", session_id) or "_") + "-" + digest
+
+
+class Persisted:
+    """
+    What the log of a session holds, kept on its coder to work out what to append next.
+    messages holds the same message dicts as the history did when it was written, so comparing is by identity.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages: list = []
+        # of messages, how many are cur_messages
+        self.current = 0
+        self.files: tuple = (frozenset(), frozenset())
+        self.size = 0
+        self.checkpoint = 0
+
+
+class ChatStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        STORE_DIR.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(INDEX_PATH, "r", encoding="utf-8") as f:
+                self.index: dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def log_path(self, session_id: str):
+        entry = self.index.get(session_id)
+        return STORE_DIR / (entry["file"] if entry else safe_name(session_id) + ".log")
+
+    def write_index(self):
+        part = INDEX_PATH.with_name(INDEX_PATH.name + ".part")
+        with open(part, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, separators=(",", ":"))
+        os.replace(part, INDEX_PATH)
+
+    def load(self, session_id: str, coder) -> bool:
+        """
+        Restore the history and files of a session into a fresh coder, returns False if nothing was stored for it.
+        """
+        start = time.perf_counter()
+        persisted = Persisted(session_id)
+        coder.persisted = persisted
+
+        with self.lock:
+            entry = self.index.get(session_id)
+            if entry is None:
+                return False
+
+            path = self.log_path(session_id)
+            try:
+                with open(path, "rb") as f:
+                    f.seek(entry["checkpoint"])
+                    data = f.read()
+            except OSError:
+                return False
+
+            messages = []
+            files = ([], [])
+            current = 0
+            end = 0
+            for end, kind, value in read_records(data):
+                if kind == APPEND:
+                    messages.extend(value)
+                elif kind == REPLACE:
+                    messages = value
+                elif kind == FILES:
+                    files = (value["files"], value["read_only"])
+                elif kind == CURRENT:
+                    current = value
+
+            persisted.checkpoint = entry["checkpoint"]
+            persisted.size = entry["checkpoint"] + end
+            if end < len(data):
+                # drop the torn record so the next append follows the last complete one
+                stats.corrupt_tails += 1
+                os.truncate(path, persisted.size)
+
+        current = min(current, len(messages))
+        coder.done_messages = messages[:len(messages) - current]
+        coder.cur_messages = messages[len(messages) - current:]
+        # files deleted since the session was saved are left out
+        coder.abs_fnames = {path for path in map(coder.abs_root_path, files[0]) if os.path.exists(path)}
+        coder.abs_read_only_fnames = {path for path in map(coder.abs_root_path, files[1]) if os.path.exists(path)}
+        persisted.messages = list(messages)
+        persisted.current = current
+        persisted.files = (frozenset(coder.abs_fnames), frozenset(coder.abs_read_only_fnames))
+
+        stats.loads += 1
+        stats.load_ms += (time.perf_counter() - start) * 1000
+        return True
+
+    def save(self, coder):
+        """
+        Append whatever changed since the last save. Cheap when nothing did, it only compares references.
+        Called from the control thread and the generation thread, the diff against what was persisted
+        and the append are done under the lock so two saves of one session never write the same records.
+        """
+        persisted: Persisted = getattr(coder, "persisted", None)
+        if persisted is None:
+            return
+
+        current = list(coder.cur_messages)
+        messages = list(coder.done_messages) + current
+        files = (frozenset(coder.abs_fnames), frozenset(coder.abs_read_only_fnames))
+
+        with self.lock:
+            count = len(persisted.messages)
+            appended = len(messages) >= count and all(a is b for a, b in zip(messages, persisted.messages))
+            if appended and len(messages) == count and files == persisted.files and len(current) == persisted.current:
+                return
+
+            records = []
+            checkpoint = not appended
+            if checkpoint:
+                records.append(encode_record(REPLACE, messages))
+            elif len(messages) > count:
+                records.append(encode_record(APPEND, messages[count:]))
+            if checkpoint or files != persisted.files:
+                records.append(encode_record(FILES, {
+                    "files": sorted(coder.get_rel_fname(name) for name in files[0]),
+                    "read_only": sorted(coder.get_rel_fname(name) for name in files[1]),
+                }))
+            if checkpoint or len(current) != persisted.current:
+                records.append(encode_record(CURRENT, len(current)))
+
+            session_id = persisted.session_id
+            if session_id not in self.index:
+                self.index[session_id] = {"file": safe_name(session_id) + ".log", "checkpoint": 0}
+                self.write_index()
+            path = self.log_path(session_id)
+
+            with open(path, "ab") as f:
+                offset = f.tell()
+                for record in records:
+                    f.write(record)
+
+            persisted.size = offset + sum(len(record) for record in records)
+            stats.records += len(records)
+            stats.bytes_written += persisted.size - offset
+
+            if checkpoint:
+                persisted.checkpoint = offset
+                self.index[session_id]["checkpoint"] = offset
+                stats.checkpoints += 1
+                if offset >= COMPACT_MIN_BYTES and offset > persisted.size * COMPACT_RATIO:
+                    self.compact(session_id, persisted)
+                self.write_index()
+
+            persisted.messages = messages
+            persisted.current = len(current)
+            persisted.files = files
+
+    def compact(self, session_id: str, persisted: Persisted):
+        """
+        Rewrite a log without the records before its last checkpoint, call with the lock held.
+        """
+        path = self.log_path(session_id)
+        part = path.with_name(path.name + ".part")
+        with open(path, "rb") as f:
+            f.seek(persisted.checkpoint)
+            data = f.read()
+        with open(part, "wb") as f:
+            f.write(data)
+        os.replace(part, path)
+
+        persisted.size -= persisted.checkpoint
+        persisted.checkpoint = 0
+        self.index[session_id]["checkpoint"] = 0
+        stats.compactions += 1
+
+    def sessions(self) -> list[str]:
+        with self.lock:
+            return list(self.index)
+
+
+store: ChatStore = None
+
+
+def open_store() -> ChatStore:
+    global store
+    if store is None:
+        store = ChatStore()
+    return store
+
+
+def load(session_id: str, coder) -> bool:
+    if store is None:
+        return False
+    return store.load(session_id, coder)
+
+
+def save(coder):
+    """
+    Persist the chat state of a session coder, safe to call after anything that may have changed it.
+    """
+    if store is None:
+        return
+    try:
+        store.save(coder)
+    except OSError as e:
+        print(f"Failed to save chat session: {e}")
@@ -0,0 +1,108 @@
+"""
+Batches the tiny chunks an LLM yields into fewer, larger frames.
+
+Every frame is a separate write on our side and a separate receive round and UI callback in Unity,
+so sending one frame per token is mostly overhead. A frame is flushed once flush_bytes are buffered
+or flush_ms have passed since the first buffered chunk, whichever comes first.
+Setting either option to 0 sends every chunk as its own frame again.
+"""
+
+import asyncio
+import metrics
+
+DEFAULT_FLUSH_BYTES = 256
+DEFAULT_FLUSH_MS = 30
+
+
+class CoalescerStats:
+    def __init__(self):
+        self.chunks = 0
+        self.frames = 0
+        self.bytes = 0
+        self.size_flushes = 0
+        self.time_flushes = 0
+        self.end_flushes = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "frames_saved": self.chunks - self.frames,
+            "size_flushes": self.size_flushes,
+            "time_flushes": self.time_flushes,
+            "end_flushes": self.end_flushes,
+        }
+
+
+stats = CoalescerStats()
+metrics.register("stream", stats.to_dict)
+
+
+class Coalescer:
+    """
+    Must be used from the event loop thread.
+    flush is called with the coalesced text every time a frame should be sent.
+    """
+
+    def __init__(self, flush, flush_bytes: int = DEFAULT_FLUSH_BYTES, flush_ms: int = DEFAULT_FLUSH_MS):
+        self.on_flush = flush
+        self.flush_bytes = flush_bytes
+        self.flush_ms = flush_ms
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.timer: asyncio.TimerHandle = None
+
+    @property
+    def passthrough(self) -> bool:
+        return self.flush_bytes <= 0 or self.flush_ms <= 0
+
+    def push(self, text: str):
+        if not text:
+            return
+
+        size = len(text.encode())
+        stats.chunks += 1
+        stats.bytes += size
+
+        if self.passthrough:
+            stats.frames += 1
+            self.on_flush(text)
+            return
+
+        self.buffer.append(text)
+        self.buffered_bytes += size
+
+        if self.buffered_bytes >= self.flush_bytes:
+            stats.size_flushes += 1
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.flush_ms / 1000, self.flush_timer)
+
+    def flush_timer(self):
+        self.timer = None
+        if self.buffer:
+            stats.time_flushes += 1
+            self.flush()
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if not self.buffer:
+            return
+
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.buffered_bytes = 0
+        stats.frames += 1
+        self.on_flush(text)
+
+    def close(self):
+        """
+        Flush whatever is left, call before sending the final frame.
+        """
+        if self.buffer:
+            stats.end_flushes += 1
+        self.flush()
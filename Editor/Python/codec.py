@@ -0,0 +1,139 @@
+"""
+Binary framing shared by the bridge and anything else talking to it.
+See Interface.cs for the C# side of the format.
+
+Version 1
+Request:  marker (987654321), content length
+Fragment: marker (987654322), content length, sequence number, last fragment
+Response: marker (123456789), content length, last, is_diff, error, tokens sent, tokens received, message cost, session cost
+
+Version 2 adds request and stream ids so requests can be pipelined and their responses interleaved.
+Responses echo the ids of the request they answer, the stream id is picked by the client to group
+related requests (a chat window for example).
+Request:  marker (987654330), content length, request id, stream id, fragment sequence number, flags
+Response: marker (123456790), version, kind, flags, request id, stream id, meta length, content length,
+          tokens sent, tokens received, message cost, session cost, meta (json), content
+Kinds are listed in AiderResponseKind, command frames (kind 1) carry one ```unity block of a streaming reply,
+batch frames (kind 3) all the commands of the reply that passed their checks.
+
+The bridge answers every request in the version it was sent in, so version 1 clients keep working.
+Send "/hello 2" to find out whether the bridge speaks version 2 before using it.
+Content lengths are always the length of the utf-8 encoded content in bytes.
+"""
+
+import json
+import socket
+import struct
+
+PROTOCOL_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+REQUEST_MARKER = 987654321
+FRAGMENT_MARKER = 987654322
+V2_REQUEST_MARKER = 987654330
+RESPONSE_MARKER = 123456789
+V2_RESPONSE_MARKER = 123456790
+
+REQUEST_HEADER = struct.Struct('<ii')
+# follows the request header of a fragment
+FRAGMENT_HEADER = struct.Struct('<I?')
+# follows the request header of a version 2 request
+V2_REQUEST_HEADER = struct.Struct('<IIIB')
+RESPONSE_HEADER = struct.Struct('<ii???iiff')
+V2_RESPONSE_HEADER = struct.Struct('<iBBBIIIIiiff')
+
+# version 2 request flags
+FRAGMENT = 1
+LAST_FRAGMENT = 2
+
+# version 2 response flags
+LAST = 1
+DIFF = 2
+ERROR = 4
+
+
+def encode_response(response) -> tuple[bytes, bytes]:
+    """
+    Returns the header and body of a response frame as two separate buffers,
+    so they can be written with a single scatter/gather write without joining them first.
+    """
+    body = response.content.encode()
+    if response.version < 2:
+        header = RESPONSE_HEADER.pack(
+            RESPONSE_MARKER, len(body), response.last, response.is_diff, response.error,
+            response.tokensSent, response.tokensReceived, response.messageCost, response.sessionCost)
+        return header, body
+
+    # meta is small, so it is sent along with the header
+    meta = json.dumps(response.meta, separators=(",", ":")).encode() if response.meta else b""
+    flags = (LAST if response.last else 0) | (DIFF if response.is_diff else 0) | (ERROR if response.error else 0)
+    header = V2_RESPONSE_HEADER.pack(
+        V2_RESPONSE_MARKER, PROTOCOL_VERSION, response.kind, flags, response.request_id, response.stream_id,
+        len(meta), len(body), response.tokensSent, response.tokensReceived, response.messageCost, response.sessionCost)
+    return header + meta, body
+
+
+def decode_request_header(data) -> tuple[int, int]:
+    return REQUEST_HEADER.unpack_from(data)
+
+
+def decode_fragment_header(data) -> tuple[int, bool]:
+    return FRAGMENT_HEADER.unpack_from(data)
+
+
+def decode_v2_request_header(data) -> tuple[int, int, int, int]:
+    return V2_REQUEST_HEADER.unpack_from(data)
+
+
+class FrameWriter:
+    """
+    Writes version 1 response frames to a blocking socket.
+    Headers are packed straight into a reusable buffer. Small bodies are copied in behind the header
+    and sent with one send, larger ones are sent together with the header by one sendmsg call
+    instead of being copied, so a frame costs no intermediate bytes objects besides the encoded body.
+
+    Only use this where the buffers are done with once write returns, the asyncio transports
+    may keep a reference to what they are given, so the bridge itself uses encode_response.
+    """
+
+    SMALL_FRAME = 4096
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = bytearray(RESPONSE_HEADER.size + self.SMALL_FRAME)
+        self.view = memoryview(self.buffer)
+        self.header_view = self.view[:RESPONSE_HEADER.size]
+        self.frames = 0
+        self.syscalls = 0
+
+    def write(self, response):
+        body = response.content.encode()
+        RESPONSE_HEADER.pack_into(
+            self.buffer, 0,
+            RESPONSE_MARKER, len(body), response.last, response.is_diff, response.error,
+            response.tokensSent, response.tokensReceived, response.messageCost, response.sessionCost)
+        self.frames += 1
+
+        # windows has no sendmsg
+        if len(body) <= self.SMALL_FRAME or not hasattr(self.sock, "sendmsg"):
+            end = RESPONSE_HEADER.size + len(body)
+            if end <= len(self.buffer):
+                self.buffer[RESPONSE_HEADER.size:end] = body
+                self.syscalls += 1
+                self.sock.sendall(self.view[:end])
+            else:
+                self.syscalls += 1
+                self.sock.sendall(bytes(self.header_view) + body)
+            return
+
+        buffers = [self.header_view, memoryview(body)]
+        while buffers:
+            sent = self.sock.sendmsg(buffers)
+            self.syscalls += 1
+
+            # drop whatever was fully sent and trim the buffer that was partially sent
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and sent:
+                buffers[0] = buffers[0][sent:]
@@ -0,0 +1,95 @@
+"""
+Microbenchmark for response frame encoding.
+
+Compares the original nine struct.pack calls joined with +, codec.encode_response,
+and codec.FrameWriter writing into a local socket pair. FrameWriter copies frames up to SMALL_FRAME bytes
+into its buffer and sends larger ones with sendmsg, so the socket writes are also run with frames over that.
+
+python codec_bench.py [frames] [content size in bytes]
+"""
+
+import socket
+import struct
+import sys
+import threading
+import time
+from codec import FrameWriter, encode_response
+from network_interface import AiderResponse
+
+
+def legacy_serialize(self: AiderResponse) -> bytes:
+    # the implementation AiderResponse.serialize used before codec.py
+    # (note it writes the length in characters, not bytes)
+    return struct.pack('<i', 123456789) + struct.pack('<i', len(self.content)) + struct.pack('<?', self.last) + struct.pack('<?', self.is_diff) + struct.pack('<?', self.error) + struct.pack('<i', self.tokensSent) + struct.pack('<i', self.tokensReceived) + struct.pack('<f', self.messageCost) + struct.pack('<f', self.sessionCost) + self.content.encode()
+
+
+def drain(sock: socket.socket, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            if not sock.recv(1 << 16):
+                return
+        except OSError:
+            return
+
+
+def bench(name: str, frames: int, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<44} {frames / elapsed:>14,.0f} frames/s")
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    response = AiderResponse("x" * size, False, True)
+
+    print(f"{frames:,} frames of {size} bytes")
+
+    def legacy():
+        for _ in range(frames):
+            legacy_serialize(response)
+
+    def codec_encode():
+        for _ in range(frames):
+            encode_response(response)
+
+    bench("legacy serialize", frames, legacy)
+    bench("codec.encode_response", frames, codec_encode)
+
+    # socket writes, the reader thread just discards everything
+    def legacy_send(sock: socket.socket, response: AiderResponse, count: int):
+        for _ in range(count):
+            sock.sendall(legacy_serialize(response))
+
+    def frame_writer_send(sock: socket.socket, response: AiderResponse, count: int):
+        writer = FrameWriter(sock)
+        for _ in range(count):
+            writer.write(response)
+
+    large_size = FrameWriter.SMALL_FRAME * 4
+    large = AiderResponse("x" * large_size, False, True)
+    path = "sendmsg" if size > FrameWriter.SMALL_FRAME else "buffer"
+    cases = [
+        ("legacy serialize + sendall", legacy_send, response, frames),
+        (f"FrameWriter.write ({path})", frame_writer_send, response, frames),
+        (f"legacy sendall, {large_size} bytes", legacy_send, large, frames // 10),
+        (f"FrameWriter.write (sendmsg), {large_size} bytes", frame_writer_send, large, frames // 10),
+    ]
+    for name, send, frame, count in cases:
+        writer_sock, reader_sock = socket.socketpair()
+        stop = threading.Event()
+        reader = threading.Thread(target=drain, args=(reader_sock, stop), daemon=True)
+        reader.start()
+
+        bench(name, count, lambda: send(writer_sock, frame, count))
+
+        stop.set()
+        writer_sock.close()
+        reader.join()
+        reader_sock.close()
+
+
+
+if __name__ == "__main__":
+    main()
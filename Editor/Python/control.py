@@ -0,0 +1,349 @@
+"""
+Cheap control plane commands (ls, add, drop, read-only, write, scene, objects, map, tokens, reset, session, batch).
+
+These are served out of band while a generation is streaming on another thread, so they must
+never mutate the coder's file sets in place, the generation may be iterating over them.
+Writers take coder_lock and swap in a new set (copy on write), readers iterate whatever set they got.
+"""
+
+import json
+import os
+import threading
+import time
+import aider_main as aider
+import file_index
+import object_details
+import scene_store
+import sessions
+import token_cache
+import transfer
+from network_interface import AiderRequest, AiderResponse
+from paths import TEMP_DIR
+
+coder_lock = threading.RLock()
+
+
+def _set_fnames(coder, add=(), remove=()):
+    fnames = set(coder.abs_fnames)
+    fnames.update(add)
+    fnames.difference_update(remove)
+    coder.abs_fnames = fnames
+
+
+def _set_read_only_fnames(coder, add=()):
+    fnames = set(coder.abs_read_only_fnames)
+    fnames.update(add)
+    coder.abs_read_only_fnames = fnames
+
+
+def ls(coder) -> AiderResponse:
+    return AiderResponse("\n".join(coder.abs_fnames), True)
+
+
+def _resolve(coder, name: str):
+    """
+    Returns (relative name, implicit, candidates) for a file that exists,
+    or (name, None, candidates) if there is no such file or the name is ambiguous.
+    """
+    if os.path.exists(name):
+        return name, False, []
+
+    # the user may have just put the name of the file not the path, see file_index.py
+    match = file_index.index_for(coder).lookup(name)
+    if match.path is not None:
+        return match.path, True, match.candidates
+
+    return name, None, match.candidates
+
+
+def _not_found(message: str, candidates: list[str]) -> AiderResponse:
+    """
+    An error that lists the files the name could have meant, they are also in the meta of version 2 frames.
+    """
+    if not candidates:
+        return AiderResponse(message, True, False, True)
+
+    response = AiderResponse(message + " Did you mean one of these?\n" + "\n".join(candidates), True, False, True)
+    response.meta = {"candidates": candidates}
+    return response
+
+
+def add(coder, name: str) -> AiderResponse:
+    name = coder.get_rel_fname(name)
+    with coder_lock:
+        name, implicit, candidates = _resolve(coder, name)
+        if implicit is not None:
+            _set_fnames(coder, add=[coder.abs_root_path(name)])
+            return AiderResponse(f"Added {name}{' implicitly.' if implicit else ''}", True)
+
+    if candidates:
+        return _not_found(f"Cannot add {name} because it matches several files.", candidates)
+    return _not_found(f"Cannot add {name} because it does not exist.", candidates)
+
+
+def read_only(coder, name: str) -> AiderResponse:
+    """
+    Add a file for reference only, files already in the chat are turned read-only.
+    """
+    name = coder.get_rel_fname(name)
+    with coder_lock:
+        name, implicit, candidates = _resolve(coder, name)
+        if implicit is not None:
+            abs_name = coder.abs_root_path(name)
+            _set_fnames(coder, remove=[abs_name])
+            _set_read_only_fnames(coder, add=[abs_name])
+            return AiderResponse(f"Added {name} as read-only{' implicitly.' if implicit else ''}", True)
+
+    if candidates:
+        return _not_found(f"Cannot add {name} because it matches several files.", candidates)
+    return _not_found(f"Cannot add {name} because it does not exist.", candidates)
+
+
+def drop(coder, name: str) -> AiderResponse:
+    name = coder.get_rel_fname(name)
+    with coder_lock:
+        if name in coder.get_inchat_relative_files():
+            _set_fnames(coder, remove=[coder.abs_root_path(name)])
+            return AiderResponse(f"Dropped {name}", True)
+
+        # do the same for drop as we did for add, the files in chat are few enough to rank directly
+        match = file_index.rank(name, coder.get_inchat_relative_files())
+        if match.path is not None:
+            _set_fnames(coder, remove=[coder.abs_root_path(match.path)])
+            return AiderResponse(f"Dropped {match.path} implicitly.", True)
+
+    if match.candidates:
+        return _not_found(f"Cannot drop {name} because it matches several files in chat.", match.candidates)
+    return _not_found(f"Cannot drop {name} because it is not in chat.", match.candidates)
+
+
+def write(coder, request: AiderRequest) -> AiderResponse:
+    """
+    /write <name> followed by the file content on the next lines, writes the file to Data/Temp and adds it.
+    """
+    path = transfer.write_body(request)
+    return add(coder, str(path))
+
+
+def write_file(coder, name: str, content: str) -> AiderResponse:
+    path = transfer.write_temp_file(name, content)
+    return add(coder, str(path))
+
+
+def scene(coder, name: str, content: str, patch: bool = False) -> AiderResponse:
+    """
+    Apply a scene snapshot or patch (see scene_store.py) and add the scene file.
+    Replies with {"scene", "epoch", "version", "objects", "written"}, a refused patch is an error.
+    """
+    name = name.strip()
+    try:
+        if patch:
+            snapshot, written = scene_store.store.patch(name, content)
+        else:
+            snapshot, written = scene_store.store.snapshot(name, content)
+    except scene_store.SceneError as e:
+        return AiderResponse(str(e), True, False, True)
+
+    added = add(coder, str(scene_store.store.path(snapshot)))
+    if added.error:
+        return added
+
+    reply = {
+        "scene": snapshot.name,
+        "epoch": scene_store.store.epoch,
+        "version": snapshot.version,
+        "objects": snapshot.object_count,
+        "written": written,
+    }
+    return AiderResponse(json.dumps(reply), True)
+
+
+def scene_request(coder, request: AiderRequest) -> AiderResponse:
+    """
+    /scene <name> or /scene-patch <name> followed by the JSON on the next lines.
+    """
+    head, _, body = request.content.partition("\n")
+    command, _, name = head.strip().partition(" ")
+    return scene(coder, name, body, command == "/scene-patch")
+
+
+def _attach_details(coder) -> AiderResponse:
+    path = object_details.materialise(coder)
+    if path is None:
+        return None
+    return add(coder, str(path))
+
+
+def objects(coder, text: str) -> AiderResponse:
+    """
+    The scene objects a message about to be sent names, see object_details.py.
+    Replies with {"paths": [...]}, the objects Unity should send the details of with "object" operations,
+    the ones whose details are cached are attached straight away.
+    """
+    paths = object_details.wanted(coder, text)
+    _attach_details(coder)
+    return AiderResponse(json.dumps({"paths": paths}), True)
+
+
+def object_info(coder, path: str, content: str) -> AiderResponse:
+    """
+    The detailed info of a scene object (SceneInfoGenerator.GetDetailedObjectInfo), empty if it wasn't found.
+    """
+    path = path.strip()
+    object_details.receive(coder, path, content)
+    if not content.strip():
+        return AiderResponse(f"{path} is not in the scene.", True)
+    return _attach_details(coder) or AiderResponse(f"Attached details of {path}", True)
+
+
+def repo_map(coder) -> AiderResponse:
+    print("Sending repo map")
+    return AiderResponse(coder.get_repo_map() or "", True)
+
+
+def _message_tokens(model, messages) -> int:
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += token_cache.cache.count(model, content)
+    return total
+
+
+def tokens(coder) -> AiderResponse:
+    """
+    How many tokens the current context takes, without sending anything. Counts are cached by content hash
+    (see token_cache.py), so this only tokenizes what changed since the last time.
+    Files in Data/Temp (the scene snapshot, the GameObject menu, dropped objects) are listed under scene.
+    The repo map is the last one aider built, it is only rebuilt when a message is sent.
+    """
+    start = time.perf_counter()
+    model = coder.main_model
+    count = token_cache.cache.count
+    prompts = coder.gpt_prompts
+
+    system = count(model, coder.fmt_system_prompt(prompts.main_system))
+    system += count(model, coder.fmt_system_prompt(prompts.system_reminder))
+    system += _message_tokens(model, [
+        dict(message, content=coder.fmt_system_prompt(message["content"])) for message in prompts.example_messages
+    ])
+
+    repo_map = getattr(coder, "repo_map", None)
+    last_map = getattr(repo_map, "last_map", None) if repo_map else None
+    repo_map_tokens = count(model, last_map) if last_map else 0
+
+    temp_dir = str(TEMP_DIR)
+    groups = {"files": [], "read_only": [], "scene": []}
+    with coder_lock:
+        fnames = list(coder.abs_fnames)
+        read_only_fnames = list(coder.abs_read_only_fnames)
+        done_messages = list(coder.done_messages)
+        cur_messages = list(coder.cur_messages)
+
+    for group, paths in (("files", fnames), ("read_only", read_only_fnames)):
+        for path in sorted(paths):
+            entry = {
+                "path": coder.get_rel_fname(path),
+                "tokens": token_cache.cache.count_file(model, path, coder.io.read_text),
+            }
+            groups["scene" if os.path.dirname(path) == temp_dir else group].append(entry)
+
+    breakdown = {
+        "system": system,
+        "repo_map": repo_map_tokens,
+        "history": _message_tokens(model, done_messages),
+        "pending": _message_tokens(model, cur_messages),
+        **{group: sum(entry["tokens"] for entry in entries) for group, entries in groups.items()},
+    }
+    total = sum(breakdown.values())
+    limit = model.info.get("max_input_tokens") or 0
+
+    reply = {
+        "total": total,
+        "limit": limit,
+        "remaining": limit - total if limit else None,
+        "breakdown": breakdown,
+        **groups,
+        "repo_map_stale": bool(repo_map) and not last_map,
+        "ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+    return AiderResponse(json.dumps(reply), True)
+
+
+def reset(coder) -> AiderResponse:
+    with coder_lock:
+        coder.abs_fnames = set()
+        coder.abs_read_only_fnames = set()
+        coder.done_messages = []
+        coder.cur_messages = []
+    return AiderResponse("Reset chat successfully.", True)
+
+
+def session(coder, chat_id: str) -> AiderResponse:
+    """
+    Switch to the session of a chat (see sessions.py), creating it if needed.
+    Replies with {"session": id, "created": bool, "files": [...], "messages": n} describing the session switched to.
+    """
+    with coder_lock:
+        coder, created = aider.activate_session(chat_id)
+        reply = {
+            "session": sessions.pool.active.id,
+            "created": created,
+            "files": sorted(coder.abs_fnames),
+            "messages": len(coder.done_messages),
+        }
+    return AiderResponse(json.dumps(reply), True)
+
+
+def batch(coder, text: str) -> AiderResponse:
+    """
+    Run an ordered list of operations in one request, holding coder_lock for all of them.
+    {"ops": [{"op": "reset"}, {"op": "scene", "arg": "Main", "content": "..."}, {"op": "add", "arg": "Assets/Player.cs"}, {"op": "ls"}]}
+    Replies with {"results": [{"op": "reset", "content": "...", "error": false}, ...]} in the same order.
+    A session operation switches chat sessions, the operations after it apply to the new session.
+    """
+    try:
+        ops = json.loads(text)
+    except json.JSONDecodeError as e:
+        return AiderResponse(f"Invalid batch: {e}", True, False, True)
+
+    if isinstance(ops, dict):
+        ops = ops.get("ops", [])
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return AiderResponse("Invalid batch: expected a list of operations.", True, False, True)
+
+    results = []
+    with coder_lock:
+        for op in ops:
+            name = op.get("op", "")
+            arg = op.get("arg", "")
+            match name:
+                case "add":
+                    response = add(coder, arg)
+                case "drop":
+                    response = drop(coder, arg)
+                case "ls":
+                    response = ls(coder)
+                case "read-only":
+                    response = read_only(coder, arg)
+                case "reset":
+                    response = reset(coder)
+                case "session":
+                    response = session(coder, arg)
+                    coder = aider.coder
+                case "scene":
+                    response = scene(coder, arg, op.get("content", ""))
+                case "scene-patch":
+                    response = scene(coder, arg, op.get("content", ""), True)
+                case "objects":
+                    response = objects(coder, op.get("content", ""))
+                case "object":
+                    response = object_info(coder, arg, op.get("content", ""))
+                case "write":
+                    response = write_file(coder, arg, op.get("content", ""))
+                case _:
+                    response = AiderResponse(f"Unknown batch operation {name}.", True, False, True)
+
+            results.append({"op": name, "content": response.content, "error": response.error})
+
+    return AiderResponse(json.dumps({"results": results}), True)
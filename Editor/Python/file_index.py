@@ -0,0 +1,232 @@
+"""
+Basename index over the files aider knows about, used to resolve the short names people type in /add and /drop.
+
+Looking a name up is a dict lookup by basename (or by stem, "Player" finds "Player.cs") followed by a
+suffix check on the few paths with that basename, instead of a scan over every tracked file.
+The index is rebuilt from git when the git index or HEAD changes, and kept up to date in between with
+add_path and remove_path (files written with /write, file watcher events).
+"""
+
+import os
+import threading
+import time
+import metrics
+
+# how many candidates an ambiguous name reports
+MAX_CANDIDATES = 10
+
+
+def normalize(name: str) -> str:
+    name = name.strip().replace("\\", "/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name
+
+
+def _stem(basename: str) -> str:
+    return basename.split(".", 1)[0]
+
+
+class FileIndexStats:
+    def __init__(self):
+        self.lookups = 0
+        self.resolved = 0
+        self.ambiguous = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_ms = 0.0
+        self.lookup_ms = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "files": sum(len(index.files) for index in _indexes.values()),
+            "lookups": self.lookups,
+            "resolved": self.resolved,
+            "ambiguous": self.ambiguous,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "last_rebuild_ms": round(self.rebuild_ms, 3),
+            "avg_lookup_ms": round(self.lookup_ms / self.lookups, 4) if self.lookups else 0.0,
+        }
+
+
+stats = FileIndexStats()
+metrics.register("file_index", stats.to_dict)
+
+
+class Match:
+    """
+    The result of a lookup, path is set if the name resolved to a single file,
+    candidates holds the best matches in rank order either way.
+    """
+
+    def __init__(self, path: str, candidates: list[str]):
+        self.path = path
+        self.candidates = candidates
+
+    @property
+    def ambiguous(self) -> bool:
+        return self.path is None and len(self.candidates) > 1
+
+
+def rank(name: str, paths) -> Match:
+    """
+    Rank the paths that name could refer to.
+    A path matches if name is a suffix of it on a path separator boundary, or if name is the stem of its file name.
+    Case sensitive suffix matches beat case insensitive ones, which beat stem matches,
+    then shallower and shorter paths come first. The name resolves if only one path is in the best tier.
+    """
+    name = normalize(name)
+    if not name:
+        return Match(None, [])
+
+    lower = name.lower()
+    scored = []
+    for path in paths:
+        path_lower = path.lower()
+        if path == name or path.endswith("/" + name):
+            tier = 0
+        elif path_lower == lower or path_lower.endswith("/" + lower):
+            tier = 1
+        elif "/" not in name and _stem(path_lower.rsplit("/", 1)[-1]) == lower:
+            tier = 2
+        else:
+            continue
+        scored.append((tier, path.count("/"), len(path), path))
+
+    if not scored:
+        return Match(None, [])
+
+    scored.sort()
+    candidates = [path for _, _, _, path in scored[:MAX_CANDIDATES]]
+    best = [entry for entry in scored if entry[0] == scored[0][0]]
+    return Match(best[0][3] if len(best) == 1 else None, candidates)
+
+
+class FileIndex:
+    """
+    Thread safe, lookups happen on the control thread while watcher events arrive from others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files: set[str] = set()
+        # lowercase basename and lowercase stem -> paths
+        self.by_basename: dict[str, set[str]] = {}
+        self.by_stem: dict[str, set[str]] = {}
+        self.stamp = None
+
+    def _insert(self, path: str):
+        self.files.add(path)
+        basename = path.rsplit("/", 1)[-1].lower()
+        self.by_basename.setdefault(basename, set()).add(path)
+        # "Player" should find Player.cs, not its .meta file as well
+        if not basename.endswith(".meta"):
+            self.by_stem.setdefault(_stem(basename), set()).add(path)
+
+    def _discard(self, path: str):
+        if path not in self.files:
+            return
+
+        self.files.discard(path)
+        basename = path.rsplit("/", 1)[-1].lower()
+        for table, key in ((self.by_basename, basename), (self.by_stem, _stem(basename))):
+            paths = table.get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del table[key]
+
+    def rebuild(self, files, stamp=None):
+        start = time.perf_counter()
+        with self.lock:
+            self.files = set()
+            self.by_basename = {}
+            self.by_stem = {}
+            for path in files:
+                self._insert(normalize(path))
+            self.stamp = stamp
+
+        stats.rebuilds += 1
+        stats.rebuild_ms = (time.perf_counter() - start) * 1000
+
+    def add_path(self, path: str):
+        with self.lock:
+            self._insert(normalize(path))
+
+    def remove_path(self, path: str):
+        with self.lock:
+            self._discard(normalize(path))
+
+    def lookup(self, name: str) -> Match:
+        start = time.perf_counter()
+        name = normalize(name)
+        basename = name.rsplit("/", 1)[-1].lower()
+        with self.lock:
+            paths = set(self.by_basename.get(basename, ()))
+            if "/" not in name:
+                paths.update(self.by_stem.get(basename, ()))
+
+        match = rank(name, paths)
+
+        stats.lookups += 1
+        stats.lookup_ms += (time.perf_counter() - start) * 1000
+        if match.path is not None:
+            stats.resolved += 1
+        elif match.candidates:
+            stats.ambiguous += 1
+        else:
+            stats.misses += 1
+        return match
+
+
+# one index per repo root, sessions on the same project share it
+_indexes: dict[str, FileIndex] = {}
+
+
+def _git_stamp(coder):
+    """
+    Changes whenever the set of tracked files may have changed (staging, commits, checkouts).
+    """
+    repo = getattr(coder, "repo", None)
+    if repo is None:
+        return None
+
+    git_dir = repo.repo.git_dir
+    stamp = []
+    for name in ("index", "HEAD"):
+        try:
+            stamp.append(os.stat(os.path.join(git_dir, name)).st_mtime_ns)
+        except OSError:
+            stamp.append(0)
+    return tuple(stamp)
+
+
+def index_for(coder) -> FileIndex:
+    """
+    The index for the coder's repo, rebuilt from git first if it is missing or out of date.
+    """
+    root = str(coder.root)
+    index = _indexes.get(root)
+    if index is None:
+        index = _indexes[root] = FileIndex()
+
+    # without git there is nothing to tell us the file list changed, so ask aider every time
+    stamp = _git_stamp(coder)
+    if stamp is None or stamp != index.stamp:
+        index.rebuild(coder.get_addable_files(), stamp)
+    return index
+
+
+def notify(root: str, added=(), removed=()):
+    """
+    Apply file watcher events to the index of a repo root, paths are relative to it.
+    """
+    index = _indexes.get(str(root))
+    if index is None:
+        return
+
+    for path in removed:
+        index.remove_path(path)
+    for path in added:
+        index.add_path(path)
@@ -0,0 +1,14 @@
+"""
+Counters reported by the /stats command.
+Modules register a function that returns a dict of their current counters under a section name.
+"""
+
+_providers = {}
+
+
+def register(name: str, provider):
+    _providers[name] = provider
+
+
+def snapshot() -> dict:
+    return {name: provider() for name, provider in _providers.items()}
@@ -1,5 +1,7 @@
 from enum import IntEnum
-import struct
+from codec import (FRAGMENT, FRAGMENT_HEADER, FRAGMENT_MARKER, LAST_FRAGMENT, REQUEST_HEADER, REQUEST_MARKER,
+                   V2_REQUEST_HEADER, V2_REQUEST_MARKER, decode_fragment_header, decode_request_header,
+                   decode_v2_request_header, encode_response)
 
 class AiderCommand(IntEnum):
     NONE = -1
@@ -21,28 +23,83 @@ class AiderCommand(IntEnum):
     UNDO = 15
     WEB = 16
     UNKNOWN = 17
+    CANCEL = 18
+    OPTIONS = 19
+    STATS = 20
+    WRITE = 21
+    HELLO = 22
+    BATCH = 23
+    STATUS = 24
+    SESSION = 25
+    TOKENS = 26
+    SCENE = 27
+    SCENE_PATCH = 28
+
+class AiderResponseKind(IntEnum):
+    TEXT = 0
+    # a ```unity command block of a streaming reply, sent as soon as the block closes (see unity_blocks.py)
+    COMMAND = 1
+    # scene objects a streaming reply named that the bridge has no details of (see object_details.py)
+    OBJECTS = 2
+    # the valid commands of a whole reply, sent after its last block to run as one undo step (see unity_commands.py)
+    BATCH = 3
 
 class AiderRequestHeader:
-    HEADER_SIZE = 8
+    HEADER_SIZE = REQUEST_HEADER.size
     
     def __init__(self, header_marker: int, content_length: int):
         self.header_marker = header_marker
         self.content_length = content_length
+        # filled in by deserialize_extension for fragments and version 2 requests
+        self.request_id = 0
+        self.stream_id = 0
+        self.sequence = 0
+        self.flags = 0
 
     @classmethod
     def deserialize(cls, data: bytes):
-        header_marker = struct.unpack('<i', data[0:4])[0]
-        if (header_marker != 987654321):
+        header_marker, content_length = decode_request_header(data)
+        if (header_marker not in (REQUEST_MARKER, FRAGMENT_MARKER, V2_REQUEST_MARKER)):
             return None
-        
-        content_length = struct.unpack('<i', data[4:8])[0]
 
         return cls(header_marker, content_length)
 
+    @property
+    def version(self) -> int:
+        return 2 if self.header_marker == V2_REQUEST_MARKER else 1
+
+    @property
+    def extension_size(self) -> int:
+        """
+        Size of the header extension that follows the first HEADER_SIZE bytes.
+        """
+        if self.header_marker == FRAGMENT_MARKER:
+            return FRAGMENT_HEADER.size
+        if self.header_marker == V2_REQUEST_MARKER:
+            return V2_REQUEST_HEADER.size
+        return 0
+
+    def deserialize_extension(self, data: bytes):
+        if self.header_marker == FRAGMENT_MARKER:
+            self.sequence, last = decode_fragment_header(data)
+            self.flags = FRAGMENT | (LAST_FRAGMENT if last else 0)
+        elif self.header_marker == V2_REQUEST_MARKER:
+            self.request_id, self.stream_id, self.sequence, self.flags = decode_v2_request_header(data)
+
+    @property
+    def is_fragment(self) -> bool:
+        return bool(self.flags & FRAGMENT)
+
+    @property
+    def is_last_fragment(self) -> bool:
+        return bool(self.flags & LAST_FRAGMENT)
+
 class AiderRequest:
     def __init__(self, content: str):
         self.header = None
         self.content = content
+        # set when the body was already streamed to a file, see transfer.py
+        self.body_path = None
     
     # see Interface.cs for the serialization function
     @classmethod
@@ -53,7 +110,21 @@ class AiderRequest:
         content = data.decode()
         print(f"Deserialized request: {content}")
 
-        return cls(content)
+        request = cls(content)
+        request.header = header
+        return request
+
+    @property
+    def version(self) -> int:
+        return self.header.version if self.header else 1
+
+    @property
+    def request_id(self) -> int:
+        return self.header.request_id if self.header else 0
+
+    @property
+    def stream_id(self) -> int:
+        return self.header.stream_id if self.header else 0
     
     def get_command_string(self) -> str:
         name = ""
@@ -91,8 +162,28 @@ class AiderResponse:
         self.tokensReceived = tokensReceived
         self.messageCost = messageCost
         self.sessionCost = sessionCost
+        # only sent in version 2 frames
+        self.kind = AiderResponseKind.TEXT
+        self.meta = None
+        self.version = 1
+        self.request_id = 0
+        self.stream_id = 0
+
+    def reply_to(self, request: AiderRequest) -> 'AiderResponse':
+        """
+        Address this response to a request, it is framed in the same version as the request.
+        """
+        if request is not None:
+            self.version = request.version
+            self.request_id = request.request_id
+            self.stream_id = request.stream_id
+        return self
 
+    # see codec.py for the frame layout
     def serialize(self) -> bytes:
-        msg = struct.pack('<i', 123456789) + struct.pack('<i', len(self.content)) + struct.pack('<?', self.last) + struct.pack('<?', self.is_diff) + struct.pack('<?', self.error) + struct.pack('<i', self.tokensSent) + struct.pack('<i', self.tokensReceived) + struct.pack('<f', self.messageCost) + struct.pack('<f', self.sessionCost) + self.content.encode()
-        return msg
+        header, body = encode_response(self)
+        return header + body
+
+    def serialize_parts(self) -> tuple[bytes, bytes]:
+        return encode_response(self)
 
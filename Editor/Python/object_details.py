@@ -0,0 +1,274 @@
+"""
+Detailed info of the scene objects the chat names, attached to the next message without asking the user for it.
+
+The scene file only has the names, components and tags of the objects, to work with one the model needs its
+component properties (SceneInfoGenerator.GetDetailedObjectInfo), which only Unity can read. Objects named by
+their full path, or by a name no other object has, are resolved against the scene (see scene_context.py):
+  - in a reply, every line is checked as it streams in, the objects the bridge has no details of are queued
+    for the session and version 2 clients are sent a frame of kind OBJECTS so they can fetch them straight away
+  - Unity sends the text of a message with an "objects" batch operation before sending it, the reply lists the
+    queued objects and the ones the message names that the bridge needs details of
+Unity sends the details with "object" batch operations. They are cached for DETAILS_TTL seconds, or until the
+object changes in the scene, so the same object isn't fetched again every turn. Each session attaches the
+details of the objects it named last, within DETAILS_BUDGET tokens, as the Data/Temp/_ObjectDetails file.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+import metrics
+import scene_store
+import transfer
+
+FILE_NAME = "_ObjectDetails"
+DETAILS_TTL = 120 # seconds
+DETAILS_BUDGET = 4000
+CHARS_PER_TOKEN = 4
+# objects attached to a session, and asked for in one turn
+MAX_ATTACHED = 16
+MAX_WANTED = 8
+MAX_CACHED = 256
+# a single object with more than this is cut short
+MAX_OBJECT_CHARS = 6000
+
+HEADER = "Details of the scene objects named in the chat, mention the full path of another object to see its details."
+
+
+class ObjectDetailsStats:
+    def __init__(self):
+        self.requested = 0
+        self.received = 0
+        self.missing = 0
+        self.cache_hits = 0
+        self.streamed = 0
+        self.writes = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "cached": len(cache.details),
+            "requested": self.requested,
+            "received": self.received,
+            "missing": self.missing,
+            "cache_hits": self.cache_hits,
+            "streamed": self.streamed,
+            "writes": self.writes,
+        }
+
+
+stats = ObjectDetailsStats()
+
+
+def format_details(path: str, text: str) -> str:
+    """
+    The JSON of GetDetailedObjectInfo as an indented outline, components under the object and properties under them.
+    """
+    try:
+        info = json.loads(text)
+    except json.JSONDecodeError:
+        info = None
+    if not isinstance(info, dict):
+        return f"{path}\n{text.strip()}"
+
+    head = path
+    if info.get("tag") not in (None, "", "Untagged"):
+        head += f" #{info['tag']}"
+    if info.get("layer") not in (None, "", "Default"):
+        head += f" @{info['layer']}"
+    if info.get("isActive") is False:
+        head += " inactive"
+
+    lines = [head]
+    for component in info.get("components") or []:
+        if not isinstance(component, dict):
+            continue
+        lines.append(f"  {component.get('type', '?')}")
+        lines.extend(f"    {prop}" for prop in component.get("properties") or [])
+
+    formatted = "\n".join(lines)
+    if len(formatted) > MAX_OBJECT_CHARS:
+        formatted = formatted[:MAX_OBJECT_CHARS] + "\n    ... (cut short)"
+    return formatted
+
+
+class Details:
+    def __init__(self, path: str, text: str, changed: int):
+        self.path = path
+        # None if Unity didn't find the object
+        self.text = text
+        self.changed = changed
+        self.time = time.monotonic()
+
+
+class DetailsCache:
+    """
+    Thread safe, filled on the control thread and read on the generation thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.details: OrderedDict[str, Details] = OrderedDict()
+
+    def fresh(self, path: str, changed: int) -> Details:
+        with self.lock:
+            details = self.details.get(path)
+        if details is None or details.changed != changed or time.monotonic() - details.time > DETAILS_TTL:
+            return None
+        return details
+
+    def put(self, details: Details):
+        with self.lock:
+            self.details[details.path] = details
+            self.details.move_to_end(details.path)
+            while len(self.details) > MAX_CACHED:
+                self.details.popitem(last=False)
+
+    def get(self, path: str) -> Details:
+        with self.lock:
+            return self.details.get(path)
+
+
+cache = DetailsCache()
+metrics.register("object_details", stats.to_dict)
+
+# guards the objects attached to and wanted by the sessions, a reply is scanned while control commands run
+state_lock = threading.RLock()
+# of what was written to the details file last, every session writes the same file before its messages
+written_digest: str = None
+
+
+def _state(coder) -> tuple[OrderedDict, OrderedDict]:
+    """
+    The objects attached to a session and the ones it still needs details of, kept on its coder.
+    """
+    if not hasattr(coder, "object_details"):
+        coder.object_details = OrderedDict()
+        coder.wanted_objects = OrderedDict()
+    return coder.object_details, coder.wanted_objects
+
+
+def _attach(coder, path: str):
+    with state_lock:
+        attached, _ = _state(coder)
+        attached[path] = None
+        attached.move_to_end(path)
+        while len(attached) > MAX_ATTACHED:
+            attached.popitem(last=False)
+
+
+def note(coder, text: str) -> list[str]:
+    """
+    Attach the objects a text names that are cached, and queue the others.
+    Returns the objects newly queued.
+    """
+    queued = []
+    for path, changed in scene_store.store.named_objects(text):
+        if cache.fresh(path, changed):
+            stats.cache_hits += 1
+            _attach(coder, path)
+            continue
+        with state_lock:
+            _, wanted = _state(coder)
+            if path not in wanted:
+                wanted[path] = changed
+                queued.append(path)
+    return queued
+
+
+def wanted(coder, message: str) -> list[str]:
+    """
+    The objects Unity should send the details of before a message is sent, see the "objects" batch operation.
+    """
+    note(coder, message)
+    with state_lock:
+        _, queue = _state(coder)
+        paths = list(queue)[-MAX_WANTED:]
+        queue.clear()
+    stats.requested += len(paths)
+    return paths
+
+
+def receive(coder, path: str, text: str):
+    """
+    Details of an object from Unity, an empty text means it wasn't found.
+    """
+    scene = scene_store.store.current()
+    changed = scene.changed.get(path, 0) if scene else 0
+    if text.strip():
+        cache.put(Details(path, format_details(path, text), changed))
+        stats.received += 1
+        _attach(coder, path)
+    else:
+        cache.put(Details(path, None, changed))
+        stats.missing += 1
+
+
+def render(coder) -> str:
+    """
+    The details attached to a session, the objects named last first, within DETAILS_BUDGET.
+    """
+    with state_lock:
+        attached = list(_state(coder)[0])
+    limit = DETAILS_BUDGET * CHARS_PER_TOKEN
+    parts = []
+    used = len(HEADER)
+    for path in reversed(attached):
+        details = cache.get(path)
+        if details is None or details.text is None:
+            continue
+        if used + len(details.text) + 2 > limit:
+            break
+        parts.append(details.text)
+        used += len(details.text) + 2
+    if not parts:
+        return ""
+    return HEADER + "\n\n" + "\n\n".join(parts) + "\n"
+
+
+def materialise(coder):
+    """
+    Write the details file for a session about to send a message, if its content changed.
+    Returns its path, or None if the session has nothing attached and there is no file to clear.
+    """
+    global written_digest
+    text = render(coder)
+    path = transfer.temp_path(FILE_NAME)
+    if not text:
+        if not path.exists():
+            return None
+        text = HEADER + "\n"
+
+    digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    with state_lock:
+        if digest != written_digest or not path.exists():
+            transfer.write_temp_file(FILE_NAME, text)
+            written_digest = digest
+            stats.writes += 1
+    return path
+
+
+class ReplyScanner:
+    """
+    Checks a reply for objects line by line as it streams, not thread safe.
+    """
+
+    def __init__(self, coder):
+        self.coder = coder
+        self.line = ""
+
+    def feed(self, text: str) -> list[str]:
+        self.line += text
+        lines, newline, self.line = self.line.rpartition("\n")
+        if not newline:
+            return []
+        return self.scan(lines)
+
+    def finish(self) -> list[str]:
+        line, self.line = self.line, ""
+        return self.scan(line) if line else []
+
+    def scan(self, text: str) -> list[str]:
+        paths = note(self.coder, text)
+        stats.streamed += len(paths)
+        return paths
@@ -0,0 +1,9 @@
+"""
+Locations shared with the Unity side, see UnityAIUtils.GetPath.
+"""
+
+from pathlib import Path
+
+EDITOR_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = EDITOR_DIR / "Data"
+TEMP_DIR = DATA_DIR / "Temp"
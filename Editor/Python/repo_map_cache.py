@@ -0,0 +1,164 @@
+"""
+Persistent cache of the tags aider's repo map is built from, so restarting the bridge
+(every domain reload in Unity) only reparses the scripts that actually changed.
+
+Entries are keyed by absolute file name and store the mtime, size and content hash the tags were parsed from.
+A file with the same mtime and size is a hit without being read, a file whose mtime changed but whose
+content hash didn't (a checkout, a reimport touching it) is a hit after hashing it, anything else is reparsed.
+The cache lives in Data/Cache~, Unity doesn't import folders ending in ~.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import metrics
+from aider.repomap import Tag
+from paths import DATA_DIR
+
+CACHE_DIR = DATA_DIR / "Cache~"
+CACHE_PATH = CACHE_DIR / "repo_map.sqlite"
+# bump when the stored format changes, old entries are dropped
+CACHE_VERSION = 1
+
+
+class RepoMapCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.parse_ms = 0.0
+        self.hash_ms = 0.0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.hash_hits + self.misses
+        return {
+            "entries": cache.count() if cache else 0,
+            "hits": self.hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.hash_hits) / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "parse_ms": round(self.parse_ms, 3),
+            "hash_ms": round(self.hash_ms, 3),
+        }
+
+
+stats = RepoMapCacheStats()
+metrics.register("repo_map_cache", stats.to_dict)
+
+
+def content_hash(fname: str) -> str:
+    start = time.perf_counter()
+    digest = hashlib.blake2b(digest_size=16)
+    with open(fname, "rb") as f:
+        while chunk := f.read(1 << 16):
+            digest.update(chunk)
+    stats.hash_ms += (time.perf_counter() - start) * 1000
+    return digest.hexdigest()
+
+
+class RepoMapCache:
+    """
+    Thread safe, the repo map is built on whichever thread formats the messages.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        # commits don't wait for the disk, losing the last few entries in a crash only costs a reparse
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS tags (fname TEXT PRIMARY KEY, mtime REAL, size INTEGER, hash TEXT, data TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.db.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(CACHE_VERSION):
+            self.db.execute("DELETE FROM tags")
+            self.db.execute("INSERT OR REPLACE INTO info VALUES ('version', ?)", (str(CACHE_VERSION),))
+        self.db.commit()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+
+    def get(self, fname: str):
+        with self.lock:
+            return self.db.execute("SELECT mtime, size, hash, data FROM tags WHERE fname = ?", (fname,)).fetchone()
+
+    def put(self, fname: str, mtime: float, size: int, hash: str, data: str):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)", (fname, mtime, size, hash, data))
+            self.db.commit()
+
+    def touch(self, fname: str, mtime: float):
+        with self.lock:
+            self.db.execute("UPDATE tags SET mtime = ? WHERE fname = ?", (mtime, fname))
+            self.db.commit()
+
+    def remove(self, fname: str):
+        with self.lock:
+            self.db.execute("DELETE FROM tags WHERE fname = ?", (fname,))
+            self.db.commit()
+
+
+cache: RepoMapCache = None
+
+
+def get_tags(get_tags_raw, tag_type, fname: str, rel_fname: str) -> list:
+    try:
+        stat = os.stat(fname)
+        entry = cache.get(fname)
+        if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            stats.hits += 1
+            return [tag_type(*tag) for tag in json.loads(entry[3])]
+        hash = content_hash(fname)
+    except OSError:
+        return []
+
+    if entry is not None and entry[2] == hash:
+        stats.hash_hits += 1
+        cache.touch(fname, stat.st_mtime)
+        return [tag_type(*tag) for tag in json.loads(entry[3])]
+
+    start = time.perf_counter()
+    tags = list(get_tags_raw(fname, rel_fname))
+    stats.parse_ms += (time.perf_counter() - start) * 1000
+    stats.misses += 1
+
+    cache.put(fname, stat.st_mtime, stat.st_size, hash, json.dumps([list(tag) for tag in tags]))
+    return tags
+
+
+def install(coder):
+    """
+    Route the tag lookups of the coder's repo map through the persistent cache.
+    """
+    global cache
+    repo_map = getattr(coder, "repo_map", None)
+    if repo_map is None:
+        return
+
+    if cache is None:
+        try:
+            cache = RepoMapCache()
+        except sqlite3.Error as e:
+            print(f"Repo map cache disabled: {e}")
+            return
+
+    get_tags_raw = repo_map.get_tags_raw
+    repo_map.get_tags = lambda fname, rel_fname: get_tags(get_tags_raw, Tag, fname, rel_fname)
+
+
+def invalidate(fname: str):
+    """
+    Forget the tags of a file, it is reparsed the next time the repo map is built.
+    """
+    if cache is None:
+        return
+
+    stats.invalidations += 1
+    cache.remove(fname)
@@ -0,0 +1,98 @@
+"""
+Token report for the scene encodings, on synthetic scenes.
+
+Compares the pretty printed JSON of SceneInfoGenerator.GetSceneInfoJson with the encoding of scene_encoding.py,
+and with the pruned scene file of scene_context.py at its default budget, which has to fit in that budget.
+Tokens are counted with tiktoken if it is installed and has its encoding, otherwise they are estimated by
+splitting the text the way GPT tokenizers do before BPE, every piece is at least one token and most common
+words and punctuation runs are exactly one, so it is close to (and slightly under) a real count.
+
+python scene_bench.py [object counts...]
+"""
+
+import json
+import random
+import re
+import sys
+import time
+import scene_context
+from scene_store import Scene
+
+NAMES = ["Rock", "Tree", "Lamp", "Crate", "Wall", "Floor", "Enemy", "Pickup", "Door", "Window", "Fence", "Barrel",
+         "Bush", "Light", "Spawn Point", "Trigger", "Platform", "Pillar", "Sign", "Collider"]
+COMPONENTS = ["MeshFilter", "MeshRenderer", "BoxCollider", "SphereCollider", "CapsuleCollider", "MeshCollider",
+              "Rigidbody", "Animator", "AudioSource", "Light", "ParticleSystem", "NavMeshAgent", "LODGroup",
+              "SkinnedMeshRenderer", "EnemyController", "Pickup", "DoorController", "Interactable"]
+TAGS = ["Untagged"] * 20 + ["Enemy", "Pickup", "Respawn", "Finish"]
+LAYERS = ["Default"] * 20 + ["Ground", "Water", "Ignore Raycast", "Interactable"]
+# the pre-tokenizer pattern of the GPT-2 family of tokenizers
+PIECES = re.compile(r"""'s|'t|'re|'ve|'m|'ll|'d| ?[A-Za-z]+| ?[0-9]+| ?[^\sA-Za-z0-9]+|\s+(?!\S)|\s+""")
+
+
+def synthetic_scene(count: int, seed: int = 0) -> dict:
+    """
+    A scene shaped like a level: a few hundred roots, nested up to five deep, siblings named like Unity duplicates.
+    """
+    rng = random.Random(seed)
+    objects = []
+    parents = [""]
+    while len(objects) < count:
+        parent = rng.choice(parents) if len(parents) > 1 and rng.random() < 0.9 else ""
+        if parent.count("/") >= 4:
+            parent = ""
+        name = rng.choice(NAMES)
+        path = f"{parent}/{name} ({len(objects)})" if parent else f"{name} ({len(objects)})"
+        components = ["Transform"] + rng.sample(COMPONENTS, rng.randint(0, 3))
+        objects.append({
+            "scenePath": path,
+            "tag": rng.choice(TAGS),
+            "layer": rng.choice(LAYERS),
+            "isActive": rng.random() > 0.05,
+            "components": components,
+        })
+        if rng.random() < 0.3:
+            parents.append(path)
+
+    objects.sort(key=lambda obj: obj["scenePath"])
+    return {"sceneName": f"Synthetic{count}", "unityVersion": "6000.0.32f1", "objects": objects}
+
+
+def token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return "tiktoken o200k_base", lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return "estimated from pre-tokenizer pieces", lambda text: sum(1 for _ in PIECES.finditer(text))
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 50_000]
+    counter, count_tokens = token_counter()
+    print(f"Tokens {counter}")
+    print(f"{'objects':>8} {'json tokens':>12} {'compact tokens':>15} {'saved':>7} {'encode ms':>10} {'pruned tokens':>14}")
+
+    for count in counts:
+        snapshot = synthetic_scene(count)
+        json_text = json.dumps(snapshot, indent=4)
+
+        scene = Scene(snapshot["sceneName"])
+        start = time.perf_counter()
+        scene.load(snapshot)
+        compact_text = scene.render()
+        encode_ms = (time.perf_counter() - start) * 1000
+
+        scene_context.focus.message = ""
+        # counted the way the bridge counts it with the model's tokenizer before a message is sent
+        pruned_text = scene_context.render(scene, count_tokens)
+        pruned_tokens = count_tokens(pruned_text)
+        assert not scene_context.budget or pruned_tokens <= scene_context.budget, f"{count} objects: the pruned scene is {pruned_tokens} tokens, over the budget of {scene_context.budget}"
+
+        json_tokens = count_tokens(json_text)
+        compact_tokens = count_tokens(compact_text)
+        saved = 1 - compact_tokens / json_tokens
+        print(f"{count:>8,} {json_tokens:>12,} {compact_tokens:>15,} {saved:>7.1%} {encode_ms:>10.1f} {pruned_tokens:>14,}")
+
+
+if __name__ == "__main__":
+    main()
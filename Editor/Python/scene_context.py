@@ -0,0 +1,379 @@
+"""
+Prunes the scene file of large scenes down to what the request is about.
+
+A big level lists tens of thousands of objects, far more than one request needs, and all of them would be sent
+with every message. Once a scene is over the token budget (UNITY_AI_SCENE_TOKENS, BUDGET by default, 0 turns
+pruning off) its file only lists, most relevant first until the budget is used up:
+  - the objects the message names, by full path or by name
+  - the objects referenced in the last few messages and replies
+  - the objects with a component or tag the message mentions
+  - the subtrees of those, then the top of the hierarchy
+with their ancestors so the hierarchy stays readable. Everything else is collapsed into lines that give the path
+of a subtree left out (or of the parent of many), how many objects it has and its most common components,
+so the model knows it is there and can name it, which lists it in the next request.
+
+The index (a trie of the paths, and the paths by name, component and tag) is built once per version of a scene.
+Sizes are estimated at CHARS_PER_TOKEN characters per token, tokenizing every object of a big scene on each
+message would cost more than it saves. The file itself is counted once with the model's tokenizer when a
+message is sent, and pruned again if it is over the budget after all.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+import metrics
+
+BUDGET = 8000
+# the compact encoding (scene_encoding.py) is mostly short names, numbers and punctuation, measured with
+# scene_bench.py at about 2.4 characters a token
+CHARS_PER_TOKEN = 2.4
+# a file the tokenizer finds over the budget is pruned again to this share of what would have fit
+RECOUNT_MARGIN = 0.95
+# share of the budget kept for the lines of the collapsed subtrees
+SUMMARY_SHARE = 0.15
+# a name, component or tag shared by more objects than this says nothing about which ones are meant
+MAX_MATCHES = 64
+MAX_RECENT = 32
+MIN_TERM = 3
+TOP_COMPONENTS = 3
+# left out children of an object beyond this many are collapsed into one line
+GROUP_CHILDREN = 3
+
+PATH_SCORE = 8
+NAME_SCORE = 4
+RECENT_SCORE = 3
+COMPONENT_SCORE = 2
+
+WORD = re.compile(r"[a-z0-9_]+")
+# names with anything but word characters in them are looked for as a whole
+NOT_WORD = re.compile(r"[^a-z0-9_]")
+
+NOTE = ("The scene is too large to list in full, only the objects relevant to the request are listed. "
+        "The collapsed subtrees are left out, name an object in one of them to have it listed.")
+
+
+def parse_budget(value: str) -> int:
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return BUDGET
+
+
+budget = parse_budget(os.environ.get("UNITY_AI_SCENE_TOKENS", ""))
+
+
+class SceneContextStats:
+    def __init__(self):
+        self.full = 0
+        self.pruned = 0
+        # files the tokenizer found over the budget
+        self.recounted = 0
+        self.index_builds = 0
+        self.index_ms = 0.0
+        self.last_listed = 0
+        self.last_total = 0
+        self.last_ms = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "budget": budget,
+            "full": self.full,
+            "pruned": self.pruned,
+            "recounted": self.recounted,
+            "index_builds": self.index_builds,
+            "index_ms": round(self.index_ms, 3),
+            "last_listed": self.last_listed,
+            "last_total": self.last_total,
+            "last_ms": round(self.last_ms, 3),
+            "recent": len(focus.recent),
+        }
+
+
+stats = SceneContextStats()
+metrics.register("scene_context", stats.to_dict)
+
+
+class SceneIndex:
+    def __init__(self, scene):
+        self.version = scene.version
+        # path -> parent path, "" is the root
+        self.parents: dict[str, str] = {}
+        self.children: dict[str, list[str]] = {}
+        # path -> objects in its subtree, itself included
+        self.sizes: dict[str, int] = {}
+        # lower case name, component or tag -> paths
+        self.names: dict[str, list[str]] = {}
+        self.components: dict[str, list[str]] = {}
+        self.tags: dict[str, list[str]] = {}
+
+        for path in sorted(scene.groups):
+            objects = scene.groups[path]
+            self.add_path(path)
+            self.names.setdefault(path.rpartition("/")[2].lower(), []).append(path)
+
+            components = {name.lower() for obj in objects for name in obj.get("components") or [] if isinstance(name, str)}
+            for component in components:
+                self.components.setdefault(component, []).append(path)
+            tags = {obj["tag"].lower() for obj in objects if isinstance(obj.get("tag"), str) and obj["tag"] != "Untagged"}
+            for tag in tags:
+                self.tags.setdefault(tag, []).append(path)
+
+            node = path
+            while node:
+                self.sizes[node] = self.sizes.get(node, 0) + len(objects)
+                node = self.parents[node]
+
+        self.phrases = [name for name in self.names if len(name) >= MIN_TERM and NOT_WORD.search(name)]
+
+    def add_path(self, path: str):
+        # parents missing from the scene (they always should be there) are added as empty nodes
+        while path and path not in self.parents:
+            parent = path.rpartition("/")[0]
+            self.parents[path] = parent
+            self.children.setdefault(parent, []).append(path)
+            path = parent
+
+    def ancestors(self, path: str) -> list[str]:
+        chain = []
+        path = self.parents.get(path, "")
+        while path:
+            chain.append(path)
+            path = self.parents[path]
+        return chain[::-1]
+
+    def subtree(self, path: str):
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            yield path
+            stack.extend(self.children.get(path, ()))
+
+    def match(self, text: str) -> dict[str, int]:
+        """
+        The paths of the objects a text refers to, with how sure that is (the *_SCORE constants).
+        """
+        scores = {}
+        if not text:
+            return scores
+
+        def score(paths, value):
+            for path in paths:
+                if scores.get(path, 0) < value:
+                    scores[path] = value
+
+        lower = text.lower()
+        tokens = WORD.findall(lower)
+        # "box collider" should find BoxCollider
+        words = {word for word in tokens + [a + b for a, b in zip(tokens, tokens[1:])] if len(word) >= MIN_TERM}
+
+        names = [name for name in words if name in self.names] + [name for name in self.phrases if name in lower]
+        for name in names:
+            paths = self.names[name]
+            score([path for path in paths if "/" in path and path.lower() in lower], PATH_SCORE)
+            if len(paths) <= MAX_MATCHES:
+                score(paths, NAME_SCORE)
+
+        for index in (self.components, self.tags):
+            for term in words & index.keys():
+                if len(index[term]) <= MAX_MATCHES:
+                    score(index[term], COMPONENT_SCORE)
+
+        return scores
+
+
+def index_for(scene) -> SceneIndex:
+    index = scene.index
+    if index is None or index.version != scene.version:
+        start = time.perf_counter()
+        index = SceneIndex(scene)
+        scene.index = index
+        stats.index_builds += 1
+        stats.index_ms += (time.perf_counter() - start) * 1000
+    return index
+
+
+class Focus:
+    """
+    What the next request is about: the message being sent and the paths referenced lately.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.message = ""
+        self.recent: OrderedDict[str, None] = OrderedDict()
+
+    def remember(self, paths):
+        with self.lock:
+            for path in paths:
+                self.recent[path] = None
+                self.recent.move_to_end(path)
+            while len(self.recent) > MAX_RECENT:
+                self.recent.popitem(last=False)
+
+    def recent_paths(self) -> list[str]:
+        with self.lock:
+            return list(self.recent)
+
+
+focus = Focus()
+
+
+def referenced(scene, text: str) -> list[str]:
+    """
+    The paths of a scene a text names, by path or by a name few objects have.
+    """
+    scores = index_for(scene).match(text)
+    return [path for path, score in scores.items() if score >= NAME_SCORE]
+
+
+def named_objects(scene, text: str) -> list[str]:
+    """
+    The objects a text names without doubt: by full path, or by a name no other object has
+    (and not just as one of the parents in a full path).
+    """
+    index = index_for(scene)
+    scores = index.match(text)
+    full = [path for path, score in scores.items() if score >= PATH_SCORE]
+    parents = {parent for path in full for parent in index.ancestors(path)}
+    unique = [
+        path for path, score in scores.items()
+        if NAME_SCORE <= score < PATH_SCORE and path not in parents and len(index.names[path.rpartition("/")[2].lower()]) == 1
+    ]
+    return [path for path in full + unique if path in scene.groups]
+
+
+def select(scene, index: SceneIndex, scores: dict[str, int], limit: int) -> tuple[dict, int]:
+    """
+    The paths to list within limit characters, returns them (in the order they were picked) and their size.
+    """
+    included = {}
+    used = 0
+
+    def cost(path):
+        # one more for the newline after the objects
+        return len(scene.render_group(path)) + 1 if path in scene.groups else 0
+
+    ranked = sorted(scores, key=lambda path: (-scores[path], path.count("/"), path))
+    for path in ranked:
+        chain = [node for node in index.ancestors(path) + [path] if node not in included]
+        chain_cost = sum(map(cost, chain))
+        if used + chain_cost > limit:
+            continue
+        for node in chain:
+            included[node] = None
+        used += chain_cost
+
+    # then the subtrees of what was picked, and what is left goes to the top of the hierarchy
+    queue = deque([path for path in ranked if path in included] + [""])
+    expanded = set()
+    while queue:
+        path = queue.popleft()
+        if path in expanded:
+            continue
+        expanded.add(path)
+        for child in index.children.get(path, ()):
+            if child not in included:
+                child_cost = cost(child)
+                if used + child_cost > limit:
+                    continue
+                included[child] = None
+                used += child_cost
+            queue.append(child)
+
+    return included, used
+
+
+def summarise(scene, index: SceneIndex, included: dict, limit: int) -> tuple[list[str], int, int]:
+    """
+    A line for the subtrees left out under each listed object, the largest first, within limit characters.
+    A few left out children get a line each, more than GROUP_CHILDREN share one.
+    Returns the lines and how many subtrees and objects didn't get one.
+    """
+    groups = []
+    for parent in ("", *included):
+        children = [child for child in index.children.get(parent, ()) if child not in included]
+        if len(children) > GROUP_CHILDREN:
+            groups.append((parent + "/*" if parent else "*", children))
+        else:
+            groups.extend((child, [child]) for child in children)
+
+    def size(group):
+        return sum(index.sizes.get(path, 0) for path in group[1])
+
+    groups.sort(key=lambda group: (-size(group), group[0]))
+
+    lines = []
+    used = 0
+    for name, roots in groups:
+        components = Counter()
+        for root in roots:
+            for path in index.subtree(root):
+                for obj in scene.groups.get(path, ()):
+                    components.update(component for component in obj.get("components") or [] if component != "Transform")
+
+        line = f"{name} ({f'{len(roots)} children, ' if len(roots) > 1 else ''}{size((name, roots))} objects"
+        if components:
+            line += ": " + ", ".join(f"{count} {component}" for component, count in components.most_common(TOP_COMPONENTS))
+        line += ")"
+        if used + len(line) + 1 > limit:
+            break
+        lines.append(line)
+        used += len(line) + 1
+
+    rest = groups[len(lines):]
+    return lines, sum(len(roots) for _, roots in rest), sum(size(group) for group in rest)
+
+
+def prune(scene, limit: int) -> tuple[str, bool]:
+    """
+    The text of a scene file within limit characters, the whole scene if it fits, and whether it was pruned.
+    """
+    if sum(len(scene.render_group(path)) + 1 for path in scene.groups) <= limit:
+        return scene.render(), False
+
+    index = index_for(scene)
+    scores = index.match(focus.message)
+    for path in focus.recent_paths():
+        if path in index.parents and scores.get(path, 0) < RECENT_SCORE:
+            scores[path] = RECENT_SCORE
+
+    # the head of the file: the legend, the note and (some of) the tables
+    limit -= len(scene.render((), NOTE)) + len(scene.tables.components.line(set(scene.tables.components.ids.values())) or "")
+    included, used = select(scene, index, scores, int(limit * (1 - SUMMARY_SHARE)))
+    collapsed, more_subtrees, more_objects = summarise(scene, index, included, limit - used)
+
+    listed = [path for path in included if path in scene.groups]
+    more = f"{more_subtrees} more subtrees with {more_objects} objects" if more_subtrees else None
+
+    stats.last_listed = sum(len(scene.groups[path]) for path in listed)
+    stats.last_total = scene.object_count
+    return scene.render(listed, NOTE, collapsed, more), True
+
+
+def render(scene, token_count=None) -> str:
+    """
+    The text of a scene file, the whole scene if it fits in the budget.
+    token_count (the model's tokenizer) checks the file once, if the estimate let it go over the budget
+    it is pruned again to a limit shrunk by how far over it was.
+    """
+    if budget <= 0:
+        stats.full += 1
+        return scene.render()
+
+    start = time.perf_counter()
+    limit = int(budget * CHARS_PER_TOKEN)
+    text, pruned = prune(scene, limit)
+    if token_count is not None:
+        tokens = token_count(text)
+        if tokens > budget:
+            stats.recounted += 1
+            text, pruned = prune(scene, int(limit * budget / tokens * RECOUNT_MARGIN))
+
+    if pruned:
+        stats.pruned += 1
+        stats.last_ms = (time.perf_counter() - start) * 1000
+    else:
+        stats.full += 1
+    return text
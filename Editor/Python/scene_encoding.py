@@ -0,0 +1,161 @@
+"""
+Compact text encoding of a scene for the context, in place of the pretty printed JSON Unity sends.
+
+The JSON repeats the same five keys and the full path of every object, which is most of its tokens. Here an
+object is one line, indented under its parent with only its own name, followed by what differs from the defaults:
+
+    Player [1,2] #1
+      Main Camera [3,4] #2
+      Model inactive
+
+Components, tags and layers are numbered in tables above the objects, most common first so they get the
+shortest numbers. Numbers stay the same for the life of a snapshot, so objects only have to be encoded again
+when they change. Transform (every object has one), tag Untagged, layer Default and active are left out.
+See scene_bench.py for how many tokens this saves.
+"""
+
+from collections import Counter
+
+INDENT = "  "
+# left out of every line
+IMPLICIT_COMPONENTS = {"Transform"}
+DEFAULT_TAG = "Untagged"
+DEFAULT_LAYER = "Default"
+
+LEGEND = [
+    "One object per line, children are indented under their parent. The path of an object is its name after the names "
+    "of its parents joined with /, e.g. Parent/Child.",
+    "After the name: [components] #tag @layer, numbered in the tables below, and inactive if the object isn't active. "
+    "Every object has a Transform, objects without a tag are Untagged and objects without a layer are on Default.",
+]
+
+
+class Table:
+    def __init__(self, title: str):
+        self.title = title
+        self.ids: dict[str, int] = {}
+
+    def id(self, name: str) -> int:
+        id = self.ids.get(name)
+        if id is None:
+            id = len(self.ids) + 1
+            self.ids[name] = id
+        return id
+
+    def line(self, used: set[int]):
+        if not used:
+            return None
+        return f"{self.title}: " + ", ".join(f"{id} {name}" for name, id in self.ids.items() if id in used)
+
+
+class Tables:
+    def __init__(self):
+        self.components = Table("Components")
+        self.tags = Table("Tags")
+        self.layers = Table("Layers")
+
+    @classmethod
+    def for_objects(cls, objects: list[dict]) -> 'Tables':
+        """
+        Tables with the names of a snapshot numbered most common first.
+        """
+        tables = cls()
+        components, tags, layers = Counter(), Counter(), Counter()
+        for obj in objects:
+            components.update(name for name in obj.get("components") or [] if name not in IMPLICIT_COMPONENTS)
+            tags[obj.get("tag")] += 1
+            layers[obj.get("layer")] += 1
+
+        for table, counts, default in ((tables.components, components, None), (tables.tags, tags, DEFAULT_TAG), (tables.layers, layers, DEFAULT_LAYER)):
+            for name, _ in counts.most_common():
+                if isinstance(name, str) and name and name != default:
+                    table.id(name)
+        return tables
+
+
+class Encoded:
+    """
+    The lines of the objects at one path, with the table entries they use.
+    """
+
+    def __init__(self, text: str, components: set[int], tags: set[int], layers: set[int]):
+        self.text = text
+        self.components = components
+        self.tags = tags
+        self.layers = layers
+
+
+def path_key(path: str) -> list[str]:
+    # sorting by the names keeps children right after their parent, "A/B" sorts after "A B" as a string
+    return path.split("/")
+
+
+def encode_group(path: str, objects: list[dict], tables: Tables) -> Encoded:
+    names = path.split("/")
+    prefix = INDENT * (len(names) - 1) + names[-1]
+    components, tags, layers = set(), set(), set()
+    lines = []
+    for obj in objects:
+        line = prefix
+        ids = [tables.components.id(name) for name in obj.get("components") or [] if isinstance(name, str) and name not in IMPLICIT_COMPONENTS]
+        if ids:
+            components.update(ids)
+            line += " [" + ",".join(map(str, ids)) + "]"
+        tag = obj.get("tag")
+        if isinstance(tag, str) and tag and tag != DEFAULT_TAG:
+            id = tables.tags.id(tag)
+            tags.add(id)
+            line += f" #{id}"
+        layer = obj.get("layer")
+        if isinstance(layer, str) and layer and layer != DEFAULT_LAYER:
+            id = tables.layers.id(layer)
+            layers.add(id)
+            line += f" @{id}"
+        if obj.get("isActive") is False:
+            line += " inactive"
+        lines.append(line)
+    return Encoded("\n".join(lines), components, tags, layers)
+
+
+def encode(scene_name: str, unity_version: str, groups: list[tuple[str, Encoded]], tables: Tables, object_count: int,
+           note: str = None, collapsed: list[str] = (), more: str = None) -> str:
+    """
+    The text of a scene from its encoded groups in path_key order.
+    note, collapsed and more describe what was left out of a pruned scene, see scene_context.py.
+    """
+    listed = sum(encoded.text.count("\n") + 1 for _, encoded in groups)
+    head = f"Scene {scene_name} (Unity {unity_version}), {object_count} objects"
+    if note:
+        head += f", {listed} listed"
+    lines = [head, *LEGEND]
+    if note:
+        lines.append(note)
+
+    used = (set(), set(), set())
+    for _, encoded in groups:
+        used[0].update(encoded.components)
+        used[1].update(encoded.tags)
+        used[2].update(encoded.layers)
+    for table, ids in zip((tables.components, tables.tags, tables.layers), used):
+        line = table.line(ids)
+        if line:
+            lines.append(line)
+    lines.append("")
+
+    stack = []
+    for path, encoded in groups:
+        names = path.split("/")
+        common = 0
+        while common < min(len(stack), len(names) - 1) and stack[common] == names[common]:
+            common += 1
+        # parents that aren't listed themselves, so the indentation still says where the object is
+        for depth in range(common, len(names) - 1):
+            lines.append(INDENT * depth + names[depth])
+        stack = names
+        lines.append(encoded.text)
+
+    if collapsed or more:
+        lines += ["", "Collapsed:", *collapsed]
+        if more:
+            lines.append(more)
+    return "\n".join(lines) + "\n"
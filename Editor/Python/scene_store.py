@@ -0,0 +1,269 @@
+"""
+The scene snapshots of the editor, kept by the bridge so Unity only has to send what changed.
+
+Unity sends the whole scene once (a "scene" batch operation, the JSON of SceneInfoGenerator.GetSceneInfoJson)
+and after that only patches ("scene-patch") that replace or remove the objects at some scene paths:
+  {"epoch": "...", "baseVersion": 3, "set": [{"path": "Player/Camera", "objects": [...]}], "remove": ["Old"]}
+Objects are grouped by path since siblings can share a name. Every change bumps the version of the scene,
+a patch only applies on top of the version it was made against. A patch against another version (or
+another epoch, the bridge restarted in between) is refused and Unity sends a snapshot again.
+
+The context file Data/Temp/_<scene> holds the scene in the compact encoding of scene_encoding.py. It is only
+written when its content changed, so an unchanged scene doesn't touch the disk, and its mtime stays put for the
+prompt cache and the token counts (see unity_coder.py).
+Scenes too large for the context are pruned to what the request is about when written, see scene_context.py.
+"""
+
+import hashlib
+import json
+import threading
+import uuid
+from collections import OrderedDict
+import metrics
+import scene_context
+import scene_encoding
+import transfer
+
+# scenes kept in memory, the least recently updated are dropped (Unity just sends a snapshot again)
+MAX_SCENES = 4
+
+
+class SceneStoreStats:
+    def __init__(self):
+        self.snapshots = 0
+        self.patches = 0
+        self.rejected = 0
+        self.objects_set = 0
+        self.objects_removed = 0
+        self.bytes_received = 0
+        self.writes = 0
+        self.writes_skipped = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "scenes": {name: len(scene.groups) for name, scene in store.scenes.items()},
+            "snapshots": self.snapshots,
+            "patches": self.patches,
+            "rejected_patches": self.rejected,
+            "objects_set": self.objects_set,
+            "objects_removed": self.objects_removed,
+            "bytes_received": self.bytes_received,
+            "writes": self.writes,
+            "writes_skipped": self.writes_skipped,
+        }
+
+
+stats = SceneStoreStats()
+
+
+class SceneError(Exception):
+    pass
+
+
+class Scene:
+    def __init__(self, name: str):
+        self.name = name
+        self.scene_name = name
+        self.unity_version = ""
+        # scene path -> objects at that path
+        self.groups: dict[str, list[dict]] = {}
+        # scene path -> the objects encoded, only the changed paths are encoded again
+        self.rendered: dict[str, scene_encoding.Encoded] = {}
+        self.tables = scene_encoding.Tables()
+        self.version = 0
+        # scene path -> the version its objects last changed in, see object_details.py
+        self.changed: dict[str, int] = {}
+        self.digest: str = None
+        # see scene_context.py
+        self.index = None
+
+    @property
+    def object_count(self) -> int:
+        return sum(len(objects) for objects in self.groups.values())
+
+    def set_group(self, path: str, objects: list):
+        self.rendered.pop(path, None)
+        self.changed[path] = self.version + 1
+        if objects:
+            self.groups[path] = objects
+        else:
+            self.groups.pop(path, None)
+
+    def load(self, snapshot: dict):
+        objects = snapshot.get("objects")
+        if not isinstance(objects, list) or not all(isinstance(obj, dict) for obj in objects):
+            raise SceneError("Invalid scene snapshot: expected a list of objects.")
+
+        self.scene_name = snapshot.get("sceneName") or self.name
+        self.unity_version = snapshot.get("unityVersion", "")
+        self.groups = {}
+        self.rendered = {}
+        self.tables = scene_encoding.Tables.for_objects(objects)
+        for obj in objects:
+            self.groups.setdefault(obj.get("scenePath", ""), []).append(obj)
+        self.version += 1
+        self.changed = dict.fromkeys(self.groups, self.version)
+
+    def patch(self, patch: dict):
+        groups = patch.get("set") or []
+        remove = patch.get("remove") or []
+        # checked before anything is applied, a patch applies whole or not at all
+        if not isinstance(groups, list):
+            raise SceneError("Invalid scene patch: expected a list of paths to set.")
+        for group in groups:
+            objects = group.get("objects") if isinstance(group, dict) else None
+            if not isinstance(objects, list) or not isinstance(group.get("path"), str) or not all(isinstance(obj, dict) for obj in objects):
+                raise SceneError("Invalid scene patch: expected {\"path\", \"objects\"} entries.")
+        if not isinstance(remove, list) or not all(isinstance(path, str) for path in remove):
+            raise SceneError("Invalid scene patch: expected a list of paths to remove.")
+
+        for group in groups:
+            self.set_group(group["path"], group["objects"])
+            stats.objects_set += len(group["objects"])
+
+        for path in remove:
+            removed = self.groups.pop(path, None)
+            if removed is not None:
+                self.rendered.pop(path, None)
+                self.changed.pop(path, None)
+                stats.objects_removed += len(removed)
+        self.version += 1
+
+    def encoded(self, path: str) -> scene_encoding.Encoded:
+        encoded = self.rendered.get(path)
+        if encoded is None:
+            encoded = scene_encoding.encode_group(path, self.groups[path], self.tables)
+            self.rendered[path] = encoded
+        return encoded
+
+    def render_group(self, path: str) -> str:
+        return self.encoded(path).text
+
+    def render(self, paths=None, note: str = None, collapsed: list[str] = (), more: str = None) -> str:
+        """
+        The scene in the encoding of scene_encoding.py, paths limits the objects to those paths.
+        note, collapsed and more describe what was left out, see scene_context.py.
+        """
+        paths = sorted(self.groups if paths is None else paths, key=scene_encoding.path_key)
+        groups = [(path, self.encoded(path)) for path in paths]
+        return scene_encoding.encode(self.scene_name, self.unity_version, groups, self.tables, self.object_count,
+                                     note, collapsed, more)
+
+
+class SceneStore:
+    """
+    Updated on the control thread and refreshed on the generation thread, see refresh.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # changes on every start of the bridge, so a patch made against a previous bridge is never applied
+        self.epoch = uuid.uuid4().hex[:12]
+        self.scenes: OrderedDict[str, Scene] = OrderedDict()
+
+    def scene(self, name: str) -> Scene:
+        with self.lock:
+            scene = self.scenes.get(name)
+            if scene is None:
+                scene = Scene(name)
+                self.scenes[name] = scene
+                while len(self.scenes) > MAX_SCENES:
+                    self.scenes.popitem(last=False)
+            self.scenes.move_to_end(name)
+            return scene
+
+    def current(self) -> Scene:
+        """
+        The scene updated last, the one open in the editor.
+        """
+        with self.lock:
+            return next(reversed(self.scenes.values()), None)
+
+    def named_objects(self, text: str) -> list[tuple[str, int]]:
+        """
+        The objects of the current scene a text names without doubt, with the version they last changed in.
+        """
+        with self.lock:
+            scene = self.current()
+            if scene is None:
+                return []
+            return [(path, scene.changed.get(path, 0)) for path in scene_context.named_objects(scene, text)]
+
+    def snapshot(self, name: str, text: str) -> tuple[Scene, bool]:
+        stats.bytes_received += len(text)
+        try:
+            snapshot = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise SceneError(f"Invalid scene snapshot: {e}")
+        if not isinstance(snapshot, dict):
+            raise SceneError("Invalid scene snapshot: expected a JSON object.")
+
+        with self.lock:
+            scene = self.scene(name)
+            scene.load(snapshot)
+            stats.snapshots += 1
+            return scene, self.materialise(scene)
+
+    def patch(self, name: str, text: str) -> tuple[Scene, bool]:
+        stats.bytes_received += len(text)
+        try:
+            patch = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise SceneError(f"Invalid scene patch: {e}")
+        if not isinstance(patch, dict):
+            raise SceneError("Invalid scene patch: expected a JSON object.")
+
+        with self.lock:
+            scene = self.scenes.get(name)
+            if scene is None or patch.get("epoch") != self.epoch or patch.get("baseVersion") != scene.version:
+                stats.rejected += 1
+                version = scene.version if scene else 0
+                raise SceneError(f"Scene {name} is at version {version} of {self.epoch}, send a snapshot.")
+
+            scene.patch(patch)
+            stats.patches += 1
+            return self.scene(name), self.materialise(scene)
+
+    def refresh(self, message: str, token_count=None):
+        """
+        Write the scene files again for a message about to be sent, large scenes are pruned to what it is about.
+        token_count is the tokenizer of the model the message goes to, see scene_context.render.
+        """
+        with self.lock:
+            scene_context.focus.message = message
+            for scene in self.scenes.values():
+                scene_context.focus.remember(scene_context.referenced(scene, message))
+                self.materialise(scene, token_count)
+
+    def remember(self, text: str):
+        """
+        Note the objects a reply refers to, they are kept in the context of the next messages.
+        """
+        with self.lock:
+            for scene in self.scenes.values():
+                scene_context.focus.remember(scene_context.referenced(scene, text))
+
+    def materialise(self, scene: Scene, token_count=None) -> bool:
+        """
+        Write the context file of a scene if its content changed, returns whether it was written.
+        """
+        text = scene_context.render(scene, token_count)
+        digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        if digest == scene.digest and self.path(scene).exists():
+            stats.writes_skipped += 1
+            return False
+
+        transfer.write_temp_file(self.file_name(scene), text)
+        scene.digest = digest
+        stats.writes += 1
+        return True
+
+    def file_name(self, scene: Scene) -> str:
+        return f"_{scene.name}"
+
+    def path(self, scene: Scene):
+        return transfer.temp_path(self.file_name(scene))
+
+
+store = SceneStore()
+metrics.register("scene_store", stats.to_dict)
@@ -0,0 +1,142 @@
+"""
+A coder per chat, so switching chats in Unity keeps each chat's history and files instead of resetting them.
+
+Every session coder shares the model, the git repo and the repo map (with its tag cache) of the coder aider
+was initialised with, only the chat state (messages, files in chat, costs) is per session.
+The least recently used sessions are evicted once there are more than MAX_SESSIONS of them or their
+chat history takes more than MEMORY_BUDGET bytes, the active session is never evicted.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+DEFAULT_SESSION = "default"
+MAX_SESSIONS = 8
+MEMORY_BUDGET = 64 * 1024 * 1024
+# rough per message overhead on top of the content, dicts and the strings of their keys
+MESSAGE_OVERHEAD = 256
+
+
+def message_bytes(messages) -> int:
+    size = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            size += len(content)
+        elif isinstance(content, list):
+            size += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+        size += MESSAGE_OVERHEAD
+    return size
+
+
+class Session:
+    def __init__(self, id: str, coder):
+        self.id = id
+        self.coder = coder
+        self.created = time.time()
+        self.last_used = self.created
+
+    def memory(self) -> int:
+        return message_bytes(self.coder.done_messages) + message_bytes(self.coder.cur_messages)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "files": len(self.coder.abs_fnames) + len(self.coder.abs_read_only_fnames),
+            "messages": len(self.coder.done_messages) + len(self.coder.cur_messages),
+            "bytes": self.memory(),
+            "idle_seconds": round(time.time() - self.last_used, 1),
+        }
+
+
+class SessionPoolStats:
+    def __init__(self):
+        self.created = 0
+        self.switches = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "active": pool.active.id if pool else None,
+            "sessions": [session.to_dict() for session in pool.sessions.values()] if pool else [],
+            "created": self.created,
+            "switches": self.switches,
+            "hits": self.hits,
+            "evictions": self.evictions,
+        }
+
+
+stats = SessionPoolStats()
+metrics.register("sessions", stats.to_dict)
+
+
+class SessionPool:
+    """
+    create is called with the base coder and the session id to make the coder of a new session.
+    Sessions are switched on the control thread, the lock only guards the pool itself.
+    """
+
+    def __init__(self, base, create):
+        self.lock = threading.Lock()
+        self.base = base
+        self.create = create
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self.active = Session(DEFAULT_SESSION, base)
+        self.sessions[DEFAULT_SESSION] = self.active
+
+    def activate(self, id: str) -> tuple[Session, bool]:
+        """
+        Make a session the active one, creating it if it doesn't exist yet.
+        Returns the session and whether it was created.
+        """
+        id = id.strip() or DEFAULT_SESSION
+        with self.lock:
+            session = self.sessions.get(id)
+            created = session is None
+            if created:
+                session = Session(id, self.create(self.base, id))
+                self.sessions[id] = session
+                stats.created += 1
+            else:
+                stats.hits += 1
+
+            self.sessions.move_to_end(id)
+            session.last_used = time.time()
+            if session is not self.active:
+                stats.switches += 1
+            self.active = session
+            self.evict()
+
+        return session, created
+
+    def evict(self):
+        """
+        Drop least recently used sessions until the pool is within its limits.
+        """
+        total = sum(session.memory() for session in self.sessions.values())
+        for id in list(self.sessions):
+            if len(self.sessions) <= MAX_SESSIONS and total <= MEMORY_BUDGET:
+                break
+
+            session = self.sessions[id]
+            if session is self.active:
+                continue
+
+            total -= session.memory()
+            del self.sessions[id]
+            stats.evictions += 1
+            print(f"Evicted chat session {id}")
+
+    def remove(self, id: str) -> bool:
+        with self.lock:
+            session = self.sessions.get(id)
+            if session is None or session is self.active:
+                return False
+            del self.sessions[id]
+            return True
+
+
+pool: SessionPool = None
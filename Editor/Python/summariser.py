@@ -0,0 +1,148 @@
+"""
+Summarises chat history on a background thread, so a turn never waits for it.
+
+Aider summarises done_messages on a thread of its own, but joins that thread at the start of the next message,
+so a slow summary adds its latency to the user's turn. Instead, once a reply is finished and the history is
+over aider's limit, the older messages are summarised here. The next message picks the summary up if it is
+ready and goes ahead with the full history if it isn't. Nothing but the generation thread changes
+done_messages in place, so the summary is applied there, and only if the history it was made from
+is still the start of the current history.
+
+The history of a session is also capped at HISTORY_BYTES_CAP, the oldest messages are dropped when a summary
+can't keep up, so memory is bounded whatever the summariser does.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import metrics
+from sessions import message_bytes
+
+HISTORY_BYTES_CAP = 2 * 1024 * 1024
+
+
+class SummariserStats:
+    def __init__(self):
+        self.scheduled = 0
+        self.applied = 0
+        self.discarded = 0
+        self.failed = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.trimmed_messages = 0
+        self.trimmed_bytes = 0
+        self.last_ms = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "scheduled": self.scheduled,
+            "applied": self.applied,
+            "discarded": self.discarded,
+            "failed": self.failed,
+            "tokens_reclaimed": self.tokens_before - self.tokens_after,
+            "trimmed_messages": self.trimmed_messages,
+            "trimmed_bytes": self.trimmed_bytes,
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+stats = SummariserStats()
+metrics.register("summariser", stats.to_dict)
+
+
+class Job:
+    def __init__(self, messages: list, future: Future):
+        self.messages = messages
+        self.future = future
+
+
+class Summariser:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summariser")
+        self.lock = threading.Lock()
+
+    def install(self, coder):
+        # aider's own summary would be joined inline at the start of the next message
+        coder.summarize_start = lambda: None
+        # the summary being made for the coder, kept on the coder so it goes away with an evicted session
+        coder.summary_job = None
+
+    def schedule(self, coder):
+        """
+        Start summarising the history of a coder if it is too big, call when a reply is finished.
+        """
+        with self.lock:
+            if coder.summary_job is not None:
+                return
+
+            messages = list(coder.done_messages)
+            if not messages or not coder.summarizer.too_big(messages):
+                return
+
+            stats.scheduled += 1
+            coder.summary_job = Job(messages, self.executor.submit(self.summarise, coder, messages))
+
+    def summarise(self, coder, messages: list) -> list:
+        start = time.perf_counter()
+        try:
+            return coder.summarizer.summarize(messages)
+        finally:
+            stats.last_ms = (time.perf_counter() - start) * 1000
+
+    def apply(self, coder):
+        """
+        Swap in a finished summary and enforce the history cap, call on the generation thread before a message.
+        Never waits for a summary that is still being made.
+        """
+        with self.lock:
+            job = coder.summary_job
+            if job is not None and job.future.done():
+                coder.summary_job = None
+            else:
+                job = None
+
+        if job is not None:
+            self.apply_job(coder, job)
+
+        self.trim(coder)
+
+    def apply_job(self, coder, job: Job):
+        try:
+            summary = job.future.result()
+        except Exception as e:
+            print(f"Failed to summarise chat history: {e}")
+            stats.failed += 1
+            return
+
+        count = len(job.messages)
+        # the history was reset or replaced while the summary was being made
+        if coder.done_messages[:count] != job.messages:
+            stats.discarded += 1
+            return
+
+        model = coder.main_model
+        stats.tokens_before += model.token_count(job.messages)
+        stats.tokens_after += model.token_count(summary)
+        stats.applied += 1
+        coder.done_messages = summary + coder.done_messages[count:]
+
+    def trim(self, coder):
+        messages = coder.done_messages
+        size = message_bytes(messages)
+        if size <= HISTORY_BYTES_CAP:
+            return
+
+        drop = 0
+        while drop < len(messages) and size > HISTORY_BYTES_CAP:
+            size -= message_bytes(messages[drop:drop + 1])
+            drop += 1
+        # the history has to start with a user message
+        while drop < len(messages) and messages[drop].get("role") != "user":
+            drop += 1
+
+        stats.trimmed_messages += drop
+        stats.trimmed_bytes += message_bytes(messages[:drop])
+        coder.done_messages = messages[drop:]
+
+
+summariser = Summariser()
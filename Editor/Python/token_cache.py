@@ -0,0 +1,108 @@
+"""
+Token counts cached by content hash, so asking how big the context is doesn't tokenize it all again.
+
+Texts are keyed by the hash of their content, files additionally by mtime and size so an unchanged file
+isn't even read. The watcher drops the entries of files that change (see watcher.py).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+MAX_ENTRIES = 8192
+
+
+class TokenCacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.count_ms = 0.0
+        self.invalidations = 0
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(cache.counts),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "count_ms": round(self.count_ms, 3),
+            "invalidations": self.invalidations,
+        }
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(errors="replace"), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    """
+    Thread safe, counts are asked for on the control thread and files are invalidated from the watcher.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (model name, content hash) -> token count, least recently used first
+        self.counts: OrderedDict[tuple, int] = OrderedDict()
+        # path -> (mtime, size, content hash)
+        self.files: dict[str, tuple] = {}
+
+    def count(self, model, text: str, digest: str = None) -> int:
+        if not text:
+            return 0
+
+        key = (model.name, digest or text_hash(text))
+        with self.lock:
+            tokens = self.counts.get(key)
+            if tokens is not None:
+                self.counts.move_to_end(key)
+                stats.hits += 1
+                return tokens
+
+        start = time.perf_counter()
+        tokens = model.token_count(text)
+        stats.count_ms += (time.perf_counter() - start) * 1000
+        stats.misses += 1
+
+        with self.lock:
+            self.counts[key] = tokens
+            while len(self.counts) > MAX_ENTRIES:
+                self.counts.popitem(last=False)
+        return tokens
+
+    def count_file(self, model, path: str, read) -> int:
+        """
+        read is called to get the content of the file if it changed since it was last counted.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return 0
+
+        with self.lock:
+            known = self.files.get(path)
+        if known is not None and known[0] == stat.st_mtime and known[1] == stat.st_size:
+            with self.lock:
+                tokens = self.counts.get((model.name, known[2]))
+            if tokens is not None:
+                stats.hits += 1
+                return tokens
+
+        text = read(path) or ""
+        digest = text_hash(text)
+        with self.lock:
+            self.files[path] = (stat.st_mtime, stat.st_size, digest)
+        return self.count(model, text, digest)
+
+    def invalidate(self, path: str):
+        with self.lock:
+            if self.files.pop(path, None) is not None:
+                stats.invalidations += 1
+
+
+cache = TokenCache()
+stats = TokenCacheStats()
+metrics.register("token_cache", stats.to_dict)
@@ -0,0 +1,134 @@
+"""
+Chunked transfers for bodies too large to send as one frame (scene snapshots, repo maps, ...).
+
+Requests can be sent as sequenced fragments, see codec.py for the fragment header.
+Responses larger than the chunk_size option of a connection are sent as several frames that
+all have is_diff set, only the last one has last set, so clients append them like a streamed reply.
+"""
+
+import codecs
+import os
+from paths import TEMP_DIR
+from network_interface import AiderRequest, AiderResponse
+
+WRITE_COMMAND = "/write"
+
+
+def temp_path(name: str):
+    # only the file name is used, a request can't write outside of the temp directory
+    return TEMP_DIR / os.path.basename(name.strip().replace("\\", "/"))
+
+
+class IncomingRequest:
+    """
+    Rebuilds a request sent as fragments, decoding utf-8 incrementally so a character
+    split across two fragments is never mangled.
+    The body of a "/write <name>" request is streamed straight to its file in Data/Temp
+    instead of being collected in memory, anything else is collected as text.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.expected_sequence = 0
+        self.head = ""
+        self.head_done = False
+        self.parts = []
+        self.file = None
+        self.path = None
+        self.size = 0
+
+    def feed(self, sequence: int, data: bytes, last: bool):
+        if sequence != self.expected_sequence:
+            raise ValueError(f"Expected fragment {self.expected_sequence}, got {sequence}")
+
+        self.expected_sequence += 1
+        self.size += len(data)
+        self.write(self.decoder.decode(data, final=last))
+
+    def write(self, text: str):
+        if self.head_done:
+            if self.file:
+                self.file.write(text)
+            else:
+                self.parts.append(text)
+            return
+
+        # wait for the first line, it tells us where the rest goes
+        self.head += text
+        head, newline, rest = self.head.partition("\n")
+        if not newline:
+            return
+
+        self.head_done = True
+        if head.strip().startswith(WRITE_COMMAND + " "):
+            self.path = temp_path(head.strip()[len(WRITE_COMMAND):])
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # written next to the destination and moved in place when complete,
+            # so nothing ever reads a half written file
+            self.file = open(self.part_path, "w", encoding="utf-8", newline="")
+            self.head = head
+            self.file.write(rest)
+        else:
+            self.parts.append(self.head)
+            self.head = ""
+
+    @property
+    def part_path(self):
+        return self.path.with_name(self.path.name + ".part")
+
+    def finish(self, header) -> AiderRequest:
+        if self.file:
+            self.file.close()
+            os.replace(self.part_path, self.path)
+            request = AiderRequest(self.head)
+            request.body_path = self.path
+        else:
+            request = AiderRequest(self.head + "".join(self.parts))
+
+        request.header = header
+        return request
+
+    def abort(self):
+        if self.file:
+            self.file.close()
+            os.remove(self.part_path)
+
+
+def write_body(request: AiderRequest):
+    """
+    Write the body of a /write request that arrived in one frame, returns the path written.
+    """
+    if request.body_path:
+        return request.body_path
+
+    head, _, body = request.content.partition("\n")
+    return write_temp_file(head.strip()[len(WRITE_COMMAND):], body)
+
+
+def write_temp_file(name: str, content: str):
+    path = temp_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = path.with_name(path.name + ".part")
+    with open(part_path, "w", encoding="utf-8", newline="") as f:
+        f.write(content)
+    os.replace(part_path, path)
+    return path
+
+
+def fragment_response(response: AiderResponse, chunk_size: int):
+    """
+    Split a response into frames of at most chunk_size characters.
+    Yields the response itself if it is small enough, chunking is off, it is an error or it is part of a stream already.
+    """
+    content = response.content
+    if chunk_size <= 0 or len(content) <= chunk_size or response.is_diff or not response.last or response.error:
+        yield response
+        return
+
+    for start in range(0, len(content), chunk_size):
+        last = start + chunk_size >= len(content)
+        fragment = AiderResponse(content[start:start + chunk_size], last, True, response.error,
+                                 response.tokensSent, response.tokensReceived, response.messageCost, response.sessionCost)
+        fragment.kind = response.kind
+        fragment.meta = response.meta if last else None
+        yield fragment
@@ -0,0 +1,157 @@
+"""
+Picks ```unity command blocks out of a reply while it is still streaming (see UnityPrompts.command_blocks).
+
+The extractor is fed the chunks of a reply as they arrive and returns every block that closed in them,
+parsed and checked against the schema of its command (see unity_commands.py), so the bridge can send each
+command on as its own frame and the editor can show it while the model is still writing the rest of the answer.
+"""
+
+import json
+import re
+import metrics
+import unity_commands
+
+OPEN_FENCE = re.compile(r"^\s*(`{3,})\s*unity\s*$")
+# the templates in the prompt end objects with a trailing comma, so the model does too
+TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+class BlockStats:
+    def __init__(self):
+        self.blocks = 0
+        self.invalid = 0
+        self.unclosed = 0
+        self.streamed_after = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "blocks": self.blocks,
+            "invalid": self.invalid,
+            "unclosed": self.unclosed,
+            # characters of reply that were still streaming after a block had been sent, summed over blocks
+            "streamed_after_blocks": self.streamed_after,
+        }
+
+
+stats = BlockStats()
+metrics.register("unity_blocks", stats.to_dict)
+
+
+class Block:
+    def __init__(self, index: int, source: str):
+        self.index = index
+        self.source = source
+        self.command: dict = None
+        self.error: str = None
+
+    @property
+    def valid(self) -> bool:
+        return self.error is None
+
+    @property
+    def command_name(self) -> str:
+        return self.command.get("command") if self.command is not None else None
+
+    def to_meta(self) -> dict:
+        meta = {"index": self.index, "valid": self.valid}
+        if self.command is not None:
+            meta["command"] = self.command_name
+        if self.error:
+            meta["error"] = self.error
+        return meta
+
+
+def parse_block(index: int, source: str) -> Block:
+    """
+    A block with its command normalised, or the error to show the model if it can't be run.
+    """
+    block = Block(index, source)
+    try:
+        # code is often written with real line breaks in its string, UnityJsonCommandParser accepts them too
+        command = json.loads(source, strict=False)
+    except json.JSONDecodeError:
+        try:
+            command = json.loads(TRAILING_COMMA.sub(r"\1", source), strict=False)
+        except json.JSONDecodeError as e:
+            block.error = f"Invalid JSON: {e}"
+            return block
+
+    if not isinstance(command, dict):
+        block.error = "Expected a JSON object."
+    elif not isinstance(command.get("command"), str):
+        block.error = "Missing the command field."
+    else:
+        block.command = command
+        try:
+            block.command = unity_commands.normalise(command)
+        except unity_commands.CommandError as e:
+            block.error = str(e)
+    return block
+
+
+class BlockExtractor:
+    """
+    Not thread safe, feed it from the thread reading the reply.
+    record counts the blocks in the stats, off for replies that were extracted before.
+    """
+
+    def __init__(self, record: bool = True):
+        self.record = record
+        self.line = ""
+        self.fence: str = None
+        self.body: list[str] = []
+        self.count = 0
+        self.emitted = 0
+
+    def feed(self, text: str) -> list[Block]:
+        if self.emitted and self.record:
+            stats.streamed_after += len(text) * self.emitted
+
+        blocks = []
+        self.line += text
+        *lines, self.line = self.line.split("\n")
+        for line in lines:
+            block = self.feed_line(line)
+            if block is not None:
+                blocks.append(block)
+        return blocks
+
+    def feed_line(self, line: str) -> Block:
+        if self.fence is None:
+            match = OPEN_FENCE.match(line)
+            if match:
+                self.fence = match.group(1)
+                self.body = []
+            return None
+
+        if line.strip() != self.fence:
+            self.body.append(line)
+            return None
+
+        block = parse_block(self.count, "\n".join(self.body))
+        self.fence = None
+        self.body = []
+        self.count += 1
+        self.emitted += 1
+        if self.record:
+            stats.blocks += 1
+            if not block.valid:
+                stats.invalid += 1
+        return block
+
+    def finish(self) -> list[Block]:
+        """
+        Call at the end of the reply, a closing fence on the very last line has no newline after it.
+        """
+        blocks = self.feed("\n") if self.line else []
+        if self.fence is not None and self.record:
+            stats.unclosed += 1
+        return blocks
+
+
+def parse_reply(text: str) -> list[Block]:
+    """
+    The blocks of a whole reply.
+    """
+    extractor = BlockExtractor(record=False)
+    return extractor.feed(text) + extractor.finish()
@@ -1,5 +1,9 @@
 from aider.coders.editblock_prompts import EditBlockPrompts
+import os
 from aider.coders.editblock_coder import EditBlockCoder
+import metrics
+import unity_files
+from paths import TEMP_DIR
 
 class UnityPrompts(EditBlockPrompts):
     command_blocks = """
@@ -145,7 +149,7 @@ instantiatePrefab Guidelines:
 Important guidelines:
 - Use "Parent/Child/ChildIWant" format for object paths.
 - Only add extra features if the user specifically asks for them.
-- You should request to see a specific objects in full (to see component properties and detailed metadata for the game object) by telling the user the FULL PATH of the object in the scene.
+- To see a specific object in full (component properties and detailed metadata for the game object), mention the FULL PATH of the object in the scene. Its details are attached to the next message automatically, so end your reply there if you need them.
 - Do not run commands until you have all information needed.
 - Make sure any types you use in commands are fully defined using their full namespaces (e.g. UnityEngine.Object not just Object).
 - Do NOT make assumptions about what properties exist when setting stuff up.
@@ -184,9 +188,130 @@ Use the following rules for SEARCH/REPLACE blocks:
 
 """
 
+class PromptCacheStats:
+    def __init__(self):
+        self.turns = 0
+        self.tokens_sent = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.stable_files = 0
+        self.volatile_files = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "turns": self.turns,
+            "tokens_sent": self.tokens_sent,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "hit_rate": hit_rate(self.cache_read_tokens, self.tokens_sent),
+            "stable_files": self.stable_files,
+            "volatile_files": self.volatile_files,
+        }
+
+
+def hit_rate(cache_read_tokens: int, tokens_sent: int) -> float:
+    if not tokens_sent:
+        return 0.0
+    return round(min(cache_read_tokens / tokens_sent, 1.0), 4)
+
+
+prompt_cache_stats = PromptCacheStats()
+metrics.register("prompt_cache", prompt_cache_stats.to_dict)
+
+
 class UnityCoder(EditBlockCoder):
     edit_format = "unity"
     gpt_prompts = UnityPrompts()
+    # "cache" orders the prompt for provider prefix caching, see format_chat_chunks
+    prompt_order = "default"
+    # the cache usage reported for the current message
+    message_cache_read_tokens = 0
+    message_cache_write_tokens = 0
+    # chat file -> (mtime, size) when the prompt was last formatted
+    file_stamps = {}
+    # set while formatting, restricts the chat files whose content goes into the prompt
+    fnames_filter = None
+
+    def get_abs_fnames_content(self):
+        for fname, content in super().get_abs_fnames_content():
+            if self.fnames_filter is None or self.fnames_filter(fname):
+                yield fname, content
+
+    def volatile_fnames(self) -> set:
+        """
+        Chat files expected to change from one turn to the next: the snapshots in Data/Temp,
+        which Unity rewrites every turn, and files that changed since the prompt was last formatted.
+        """
+        temp_dir = str(TEMP_DIR)
+        stamps = {}
+        volatile = set()
+        for fname in list(self.abs_fnames):
+            try:
+                stat = os.stat(fname)
+                stamps[fname] = (stat.st_mtime, stat.st_size)
+            except OSError:
+                stamps[fname] = None
+            if os.path.dirname(fname) == temp_dir or self.file_stamps.get(fname) != stamps[fname]:
+                volatile.add(fname)
+
+        self.file_stamps = stamps
+        return volatile
+
+    def format_chat_chunks(self):
+        """
+        In "cache" order the chat files that don't change between turns move up next to the repo map,
+        ahead of the chat history, and only the volatile ones stay behind the history. The cached prefix
+        (system prompt, examples, repo map, stable files) then survives a new scene snapshot or a new message.
+        aider puts its cache marker at the end of the repo chunk, so it lands after the stable files.
+        """
+        if self.prompt_order != "cache" or not self.abs_fnames:
+            return super().format_chat_chunks()
+
+        volatile = self.volatile_fnames()
+        prompt_cache_stats.volatile_files += len(volatile)
+        prompt_cache_stats.stable_files += len(self.abs_fnames) - len(volatile)
+        if len(volatile) == len(self.abs_fnames):
+            return super().format_chat_chunks()
+
+        try:
+            if volatile:
+                self.fnames_filter = lambda fname: fname in volatile
+            chunks = super().format_chat_chunks()
+            if volatile:
+                self.fnames_filter = lambda fname: fname not in volatile
+                stable = self.get_chat_files_messages()
+            else:
+                stable = chunks.chat_files
+                chunks.chat_files = []
+        finally:
+            self.fnames_filter = None
+
+        chunks.repo = chunks.repo + stable
+        return chunks
+
+    def calculate_and_show_tokens_and_cost(self, messages, completion=None):
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            cache_read = getattr(usage, "prompt_cache_hit_tokens", 0) or getattr(usage, "cache_read_input_tokens", 0) or 0
+            cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+            self.message_cache_read_tokens += cache_read
+            self.message_cache_write_tokens += cache_write
+            prompt_cache_stats.cache_read_tokens += cache_read
+            prompt_cache_stats.cache_write_tokens += cache_write
+            prompt_cache_stats.tokens_sent += getattr(usage, "prompt_tokens", 0) or 0
+            prompt_cache_stats.turns += 1
+
+        super().calculate_and_show_tokens_and_cost(messages, completion)
+
+    def get_all_relative_files(self):
+        # the repo map and file mentions only see the files the Unity file policy includes, see unity_files.py
+        return unity_files.universe_for(self.root).mapped_files(super().get_all_relative_files())
+
+    def get_addable_files(self):
+        """
+        Every file that can be added by name, including the ones the policy keeps out of the repo map.
+        """
+        return unity_files.universe_for(self.root).addable_files(super().get_all_relative_files())
     example_messages = [
         dict(
             role="user",
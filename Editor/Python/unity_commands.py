@@ -0,0 +1,250 @@
+"""
+Schemas of the ```unity commands (see UnityPrompts.command_blocks), checked before a command reaches Unity.
+
+Unity only finds out a block is wrong once UnityJsonCommandParser runs it, a round trip to the editor and
+another turn to fix it. Here every block is checked against the schema of its command as it is extracted
+(see unity_blocks.py), and put in the shape the command classes in UnityCommands.cs read with JsonUtility:
+  - vectors given as [x, y, z] or with numbers as strings become {"x": .., "y": .., "z": ..}, position,
+    rotation and scale are accepted for localPosition, localRotation and localScale
+  - instantiatePrefab reads position, rotation and scale as float arrays, not the vectors of the template
+  - setComponentProperty values that are numbers or booleans become strings, the parser only reads those
+  - missing optional fields get the values the prompt says to use, unknown ones are dropped
+Version 2 clients run the valid commands of a reply from one batch frame, as a single undo step, and never
+the blocks that failed, so for them the errors are sent back to the model in the same cycle (see reflection).
+Version 1 clients run every block they find in the text, so their replies are not reflected.
+"""
+
+import json
+import metrics
+
+
+class Kind:
+    STRING = "string"
+    BOOL = "bool"
+    VECTOR = "vector"
+    # float[3] in the command class
+    ARRAY = "array"
+    # whatever setComponentProperty is setting, sent on as a string or JSON object
+    VALUE = "value"
+
+
+REFLECTION = """Some ```unity command blocks in your reply failed their checks and were left out of the commands sent to Unity:
+
+{errors}
+
+Send corrected versions of only these blocks, the others passed."""
+
+
+class CommandStats:
+    def __init__(self):
+        self.checked = 0
+        self.rejected = 0
+        self.reflections = 0
+        self.batches = 0
+        self.batched = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "reflections": self.reflections,
+            "batches": self.batches,
+            "batched_commands": self.batched,
+        }
+
+
+stats = CommandStats()
+metrics.register("unity_commands", stats.to_dict)
+
+
+class CommandError(ValueError):
+    pass
+
+
+class Field:
+    def __init__(self, name: str, kind: str, required: bool = False, default=None, aliases: tuple = ()):
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.aliases = aliases
+
+
+def transform_fields(kind: str, prefix: bool) -> list[Field]:
+    zero = [0, 0, 0] if kind == Kind.ARRAY else None
+    one = [1, 1, 1] if kind == Kind.ARRAY else None
+    fields = []
+    for name, default in (("position", zero), ("rotation", zero), ("scale", one)):
+        local = "local" + name.capitalize()
+        if prefix:
+            fields.append(Field(local, kind, default=default, aliases=(name,)))
+        else:
+            fields.append(Field(name, kind, default=default, aliases=(local,)))
+    return fields
+
+
+COMMANDS: dict[str, list[Field]] = {
+    "addObject": [
+        Field("scenePath", Kind.STRING, required=True),
+        Field("objectType", Kind.STRING, default="GameObject"),
+        *transform_fields(Kind.VECTOR, prefix=True),
+        Field("tag", Kind.STRING),
+        Field("layer", Kind.STRING),
+    ],
+    "addObjectMenu": [
+        Field("menuPath", Kind.STRING, required=True),
+        Field("scenePath", Kind.STRING, required=True),
+        *transform_fields(Kind.VECTOR, prefix=True),
+        Field("tag", Kind.STRING),
+        Field("layer", Kind.STRING),
+    ],
+    "addComponent": [
+        Field("objectPath", Kind.STRING, required=True),
+        Field("componentType", Kind.STRING, required=True),
+    ],
+    "executeCode": [
+        Field("shortDescription", Kind.STRING),
+        Field("code", Kind.STRING, required=True),
+    ],
+    "setComponentProperty": [
+        Field("objectPath", Kind.STRING, required=True),
+        Field("componentType", Kind.STRING, required=True),
+        Field("propertyPath", Kind.STRING, required=True),
+        Field("value", Kind.VALUE, required=True),
+    ],
+    "deleteObject": [
+        Field("objectPath", Kind.STRING, required=True),
+    ],
+    "createPrefab": [
+        Field("objectPath", Kind.STRING, required=True),
+        Field("prefabPath", Kind.STRING, required=True),
+    ],
+    "instantiatePrefab": [
+        Field("prefabPath", Kind.STRING, required=True),
+        *transform_fields(Kind.ARRAY, prefix=False),
+        Field("parentPath", Kind.STRING),
+    ],
+    "setParent": [
+        Field("objectPath", Kind.STRING, required=True),
+        Field("parentPath", Kind.STRING),
+        Field("worldPositionStays", Kind.BOOL, default=True),
+    ],
+}
+
+
+def number(value, name: str) -> float:
+    if isinstance(value, bool):
+        raise CommandError(f"{name} must be a number, not {json.dumps(value)}.")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return float(value.strip().rstrip("fF"))
+        except ValueError:
+            pass
+    raise CommandError(f"{name} must be a number, not {json.dumps(value)}.")
+
+
+def vector(value, name: str) -> list:
+    if isinstance(value, (list, tuple)):
+        if len(value) != 3:
+            raise CommandError(f"{name} must have 3 numbers, not {len(value)}.")
+        return [number(item, f"{name}[{i}]") for i, item in enumerate(value)]
+    if isinstance(value, dict):
+        unknown = value.keys() - {"x", "y", "z"}
+        if unknown:
+            raise CommandError(f"{name} only takes x, y and z, not {', '.join(sorted(unknown))}.")
+        return [number(value.get(axis, 0), f"{name}.{axis}") for axis in "xyz"]
+    raise CommandError(f'{name} must be {{"x": .., "y": .., "z": ..}}, not {json.dumps(value)}.')
+
+
+def convert(field: Field, value):
+    match field.kind:
+        case Kind.STRING:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return str(value)
+            if not isinstance(value, str):
+                raise CommandError(f"{field.name} must be a string, not {json.dumps(value)}.")
+            return value
+        case Kind.BOOL:
+            if isinstance(value, str) and value.lower() in ("true", "false"):
+                return value.lower() == "true"
+            if not isinstance(value, bool):
+                raise CommandError(f"{field.name} must be true or false, not {json.dumps(value)}.")
+            return value
+        case Kind.VECTOR:
+            return dict(zip("xyz", vector(value, field.name)))
+        case Kind.ARRAY:
+            return vector(value, field.name)
+        case Kind.VALUE:
+            if isinstance(value, bool):
+                return "true" if value else "false"
+            if isinstance(value, (int, float)):
+                return str(value)
+            if isinstance(value, (str, dict)):
+                return value
+            raise CommandError(f"value must be a string, a number or a JSON object, not {json.dumps(value)}.")
+
+
+def check(name: str, command: dict):
+    """
+    Checks of single commands the field types don't cover.
+    """
+    if name == "createPrefab":
+        path = command["prefabPath"]
+        if not path.startswith("Assets/") or not path.endswith(".prefab"):
+            raise CommandError(f"prefabPath must be Assets/<path/to/prefab.prefab>, not {path}.")
+    for field in ("scenePath", "objectPath", "prefabPath", "menuPath", "code", "componentType", "propertyPath"):
+        if field in command and not command[field].strip():
+            raise CommandError(f"{field} is empty.")
+
+
+def normalise(command: dict) -> dict:
+    """
+    The command in the shape its class in UnityCommands.cs reads, raises CommandError if it can't be run.
+    """
+    name = command.get("command")
+    fields = COMMANDS.get(name)
+    if fields is None:
+        raise CommandError(f"Unknown command {name}, use one of {', '.join(COMMANDS)}.")
+
+    normalised = {"command": name}
+    for field in fields:
+        key = next((key for key in (field.name, *field.aliases) if command.get(key) is not None), None)
+        if key is None:
+            if field.required:
+                raise CommandError(f"{name} needs {field.name}.")
+            if field.default is not None:
+                normalised[field.name] = field.default
+            continue
+        normalised[field.name] = convert(field, command[key])
+
+    check(name, normalised)
+    return normalised
+
+
+def reflection(blocks) -> str:
+    """
+    The message sent back to the model for the blocks of a reply that failed, None if none did.
+    """
+    stats.checked += len(blocks)
+    stats.rejected += sum(1 for block in blocks if not block.valid)
+    errors = [
+        f"Block {block.index + 1}{f' ({block.command_name})' if block.command_name else ''}: {block.error}\n```unity\n{block.source.strip()}\n```"
+        for block in blocks if not block.valid
+    ]
+    if not errors:
+        return None
+    stats.reflections += 1
+    return REFLECTION.format(errors="\n\n".join(errors))
+
+
+def batch(blocks) -> list[dict]:
+    """
+    The valid commands of a reply, in order, to run as one transaction.
+    """
+    commands = [block.command for block in blocks if block.valid]
+    if commands:
+        stats.batches += 1
+        stats.batched += len(commands)
+    return commands
@@ -0,0 +1,231 @@
+"""
+Unity aware filter over the files aider knows about.
+
+Most of a Unity repo is .meta files, serialized scenes and assets (YAML) and binary art, none of which
+help the model and all of which aider would otherwise crawl for the repo map and file mentions.
+Every path is put in a category by its extension and location, and a policy decides per category whether
+the files are included (repo map, file mentions, /add by name), lazy (only /add by name) or excluded.
+
+The policy can be changed with UNITY_AI_FILE_POLICY, for example "serialized=exclude meta=lazy",
+it is read at startup so it can go in the .env file with the api keys.
+"""
+
+import os
+import threading
+import metrics
+
+INCLUDE = "include"
+LAZY = "lazy"
+EXCLUDE = "exclude"
+POLICIES = (INCLUDE, LAZY, EXCLUDE)
+
+SCRIPT = "script"
+META = "meta"
+SERIALIZED = "serialized"
+BINARY = "binary"
+GENERATED = "generated"
+OTHER = "other"
+CATEGORIES = (SCRIPT, META, SERIALIZED, BINARY, GENERATED, OTHER)
+
+SCRIPT_EXTENSIONS = {
+    ".cs", ".shader", ".compute", ".hlsl", ".cginc", ".glsl", ".shadergraph", ".shadersubgraph",
+    ".uss", ".uxml", ".asmdef", ".asmref", ".inputactions", ".py",
+}
+SERIALIZED_EXTENSIONS = {
+    ".unity", ".prefab", ".asset", ".mat", ".anim", ".controller", ".overridecontroller", ".mask",
+    ".physicmaterial", ".physicsmaterial2d", ".lighting", ".playable", ".signal", ".spriteatlas",
+    ".spriteatlasv2", ".terrainlayer", ".guiskin", ".fontsettings", ".mixer", ".rendertexture", ".cubemap",
+    ".flare", ".brush", ".preset",
+}
+BINARY_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".tga", ".tif", ".tiff", ".psd", ".psb", ".bmp", ".gif", ".exr", ".hdr", ".dds",
+    ".fbx", ".obj", ".blend", ".max", ".ma", ".mb", ".3ds", ".dae", ".gltf", ".glb",
+    ".wav", ".mp3", ".ogg", ".aif", ".aiff", ".flac", ".mp4", ".mov", ".webm", ".avi",
+    ".ttf", ".otf", ".dll", ".so", ".dylib", ".a", ".lib", ".exe", ".bundle", ".pdb", ".mdb",
+    ".zip", ".unitypackage", ".bytes", ".bank", ".pdf",
+}
+
+# folders Unity and IDEs generate next to Assets, anywhere outside of Assets/ and Packages/
+GENERATED_DIRS = {"library", "temp", "obj", "logs", "build", "builds", "usersettings", "memorycaptures", "recordings"}
+# never worth looking into, wherever they are
+IGNORED_DIRS = {".git", ".vs", ".idea", ".gradle", "__pycache__", ".aider.tags.cache.v3", ".aider.tags.cache.v4"}
+
+DEFAULT_POLICY = {
+    SCRIPT: INCLUDE,
+    OTHER: INCLUDE,
+    SERIALIZED: LAZY,
+    META: EXCLUDE,
+    BINARY: EXCLUDE,
+    GENERATED: EXCLUDE,
+}
+
+
+def parse_policy(text: str) -> dict:
+    """
+    "category=policy category=policy ...", unknown categories and policies are reported and ignored.
+    """
+    policy = dict(DEFAULT_POLICY)
+    for pair in text.replace(",", " ").split():
+        category, _, value = pair.partition("=")
+        category = category.strip().lower()
+        value = value.strip().lower()
+        if category not in CATEGORIES or value not in POLICIES:
+            print(f"Ignoring invalid file policy {pair}")
+            continue
+        policy[category] = value
+    return policy
+
+
+def classify(path: str) -> str:
+    """
+    The category of a path relative to the repo root.
+    """
+    parts = path.replace("\\", "/").lower().split("/")
+    for i, part in enumerate(parts[:-1]):
+        if part in IGNORED_DIRS:
+            return GENERATED
+        # Library/ of a project at the repo root or in a subfolder, but not a folder called Library inside Assets/
+        if part in GENERATED_DIRS and "assets" not in parts[:i] and "packages" not in parts[:i]:
+            return GENERATED
+
+    basename = parts[-1]
+    if basename.endswith(".meta"):
+        return META
+
+    _, dot, ext = basename.rpartition(".")
+    ext = "." + ext if dot else ""
+    if ext in SCRIPT_EXTENSIONS:
+        return SCRIPT
+    if ext in SERIALIZED_EXTENSIONS:
+        return SERIALIZED
+    if ext in BINARY_EXTENSIONS:
+        return BINARY
+    return OTHER
+
+
+class UniverseStats:
+    def __init__(self):
+        self.files = 0
+        self.mapped = 0
+        self.lazy = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.by_category = {}
+        self.classifications = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "policy": policy,
+            "files": self.files,
+            "mapped": self.mapped,
+            "lazy": self.lazy,
+            "skipped": self.skipped,
+            "skipped_bytes": self.skipped_bytes,
+            "categories": self.by_category,
+            "classifications": self.classifications,
+        }
+
+
+stats = UniverseStats()
+metrics.register("unity_files", stats.to_dict)
+
+policy = parse_policy(os.environ.get("UNITY_AI_FILE_POLICY", ""))
+
+
+class Universe:
+    """
+    The tracked files of a repo split by policy. Splitting is cached until the tracked files change,
+    aider asks for them several times per message.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.source = None
+        self.mapped: list[str] = []
+        self.lazy: list[str] = []
+
+    def update(self, files):
+        files = tuple(files)
+        with self.lock:
+            if files == self.source:
+                return
+
+            mapped = []
+            lazy = []
+            skipped_bytes = 0
+            by_category = {category: {"files": 0, "bytes": 0} for category in CATEGORIES}
+            for path in files:
+                category = classify(path)
+                counts = by_category[category]
+                counts["files"] += 1
+                if policy[category] == INCLUDE:
+                    mapped.append(path)
+                    continue
+                if policy[category] == LAZY:
+                    lazy.append(path)
+
+                # bytes are only counted for what is kept out of the repo map
+                try:
+                    size = os.stat(os.path.join(self.root, path)).st_size
+                except OSError:
+                    size = 0
+                counts["bytes"] += size
+                if policy[category] == EXCLUDE:
+                    skipped_bytes += size
+
+            self.source = files
+            self.mapped = mapped
+            self.lazy = lazy
+
+        stats.classifications += 1
+        stats.files = len(files)
+        stats.mapped = len(mapped)
+        stats.lazy = len(lazy)
+        stats.skipped = len(files) - len(mapped) - len(lazy)
+        stats.skipped_bytes = skipped_bytes
+        stats.by_category = {category: counts for category, counts in by_category.items() if counts["files"]}
+
+    def mapped_files(self, files) -> list[str]:
+        """
+        The files aider may crawl, for the repo map and file mentions.
+        """
+        self.update(files)
+        return self.mapped
+
+    def addable_files(self, files) -> list[str]:
+        """
+        The files that can be added to the chat by name, the mapped ones and the lazy ones.
+        """
+        self.update(files)
+        return self.mapped + self.lazy
+
+
+_universes: dict[str, Universe] = {}
+
+
+def universe_for(root) -> Universe:
+    root = str(root)
+    universe = _universes.get(root)
+    if universe is None:
+        universe = _universes[root] = Universe(root)
+    return universe
+
+
+def walk(directory) -> list[str]:
+    """
+    All the files under directory that aren't excluded by the policy, for --read with a directory.
+    Generated and ignored folders are pruned instead of walked.
+    """
+    directory = os.path.abspath(directory)
+    found = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        is_project = any(name.lower() == "assets" for name in dirnames)
+        dirnames[:] = [
+            name for name in dirnames
+            if name.lower() not in IGNORED_DIRS and not (is_project and name.lower() in GENERATED_DIRS)
+        ]
+        for name in filenames:
+            if policy[classify(name)] != EXCLUDE:
+                found.append(os.path.join(dirpath, name))
+    return found
@@ -0,0 +1,155 @@
+"""
+Watches the project for file changes and invalidates only what they affect:
+the tags of the changed files in the repo map cache, the rendered repo map, the basename index
+and the token counts of the changed files.
+
+Changes arrive debounced in batches on a daemon thread, so saving a dozen scripts from the editor
+(or an asset import touching hundreds of files) is handled in one go.
+Generated folders (Library/, Temp/, ...) and files the Unity file policy excludes are never reported.
+"""
+
+import atexit
+import os
+import threading
+import time
+from watchfiles import Change, watch
+import file_index
+import metrics
+import repo_map_cache
+import token_cache
+import unity_files
+
+DEBOUNCE_MS = 400
+# seconds
+STOP_TIMEOUT = 1.0
+
+
+class WatcherStats:
+    def __init__(self):
+        self.running = False
+        self.batches = 0
+        self.added = 0
+        self.modified = 0
+        self.removed = 0
+        self.map_invalidations = 0
+        self.last_batch_ms = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "running": self.running,
+            "batches": self.batches,
+            "added": self.added,
+            "modified": self.modified,
+            "removed": self.removed,
+            "map_invalidations": self.map_invalidations,
+            "last_batch_ms": round(self.last_batch_ms, 3),
+        }
+
+
+stats = WatcherStats()
+metrics.register("watcher", stats.to_dict)
+
+
+class Watcher:
+    def __init__(self, coder):
+        self.coder = coder
+        self.root = str(coder.root)
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread = None
+
+    def relative(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace("\\", "/")
+
+    def filter(self, change: Change, path: str) -> bool:
+        rel = self.relative(path)
+        if rel.startswith("../"):
+            return False
+        return unity_files.policy[unity_files.classify(rel)] != unity_files.EXCLUDE
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        # the watch loop notices the stop event between polls, let it finish so it isn't torn down mid call at exit
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(STOP_TIMEOUT)
+
+    def run(self):
+        stats.running = True
+        try:
+            for changes in watch(self.root, watch_filter=self.filter, debounce=DEBOUNCE_MS,
+                                 stop_event=self.stop_event, raise_interrupt=False):
+                try:
+                    self.apply(changes)
+                except Exception as e:
+                    print(f"Failed to apply file changes: {e}")
+        except Exception as e:
+            print(f"File watcher stopped: {e}")
+        finally:
+            stats.running = False
+
+    def apply(self, changes):
+        start = time.perf_counter()
+        added = []
+        modified = []
+        removed = []
+        for change, path in changes:
+            match change:
+                case Change.added:
+                    added.append(path)
+                case Change.modified:
+                    modified.append(path)
+                case Change.deleted:
+                    removed.append(path)
+
+        # a file that was replaced shows up as deleted and added, it still exists so it only needs reparsing
+        removed = [path for path in removed if not os.path.exists(path)]
+
+        on_changed(self.coder, added, modified, removed)
+
+        stats.batches += 1
+        stats.added += len(added)
+        stats.modified += len(modified)
+        stats.removed += len(removed)
+        stats.last_batch_ms = (time.perf_counter() - start) * 1000
+
+
+def on_changed(coder, added=(), modified=(), removed=()):
+    """
+    Invalidate what depends on the given files, paths are absolute.
+    """
+    root = str(coder.root)
+    changed = [*added, *modified, *removed]
+
+    for path in changed:
+        repo_map_cache.invalidate(path)
+        token_cache.cache.invalidate(path)
+
+    rel_added = [os.path.relpath(path, root) for path in added]
+    rel_removed = [os.path.relpath(path, root) for path in removed]
+    file_index.notify(root, added=rel_added, removed=rel_removed)
+
+    # the rendered map depends on every mapped file, so any change to one of them means rendering it again
+    repo_map = getattr(coder, "repo_map", None)
+    if repo_map is not None and any(
+        unity_files.policy[unity_files.classify(os.path.relpath(path, root))] == unity_files.INCLUDE for path in changed
+    ):
+        repo_map.map_cache = {}
+        repo_map.last_map = None
+        stats.map_invalidations += 1
+
+
+watcher: Watcher = None
+
+
+def start(coder):
+    global watcher
+    if watcher is not None:
+        watcher.stop()
+
+    watcher = Watcher(coder)
+    watcher.start()
+    atexit.register(watcher.stop)
+    return watcher